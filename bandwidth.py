@@ -0,0 +1,69 @@
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    from config import DownloadConfig
+
+
+# Budget an idle budget may save up, so short pauses aren't penalized
+BURST_SECONDS = 1.0
+
+
+class BandwidthBudget:
+    """A token bucket shared by every download in the process. Callers
+    report the bytes they received and are put to sleep for as long as
+    it takes the budget to pay for them.
+
+    The rate is looked up on every call, so schedules take effect
+    without restarting running downloads.
+    """
+
+    def __init__(
+        self, get_rate: Callable[[], Optional[float]] = lambda: None
+    ) -> None:
+        self.get_rate = get_rate
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        # When the bytes consumed so far will have been paid for
+        self._paid_until = time.monotonic()
+
+    def consume(self, n: int) -> None:
+        rate = self.get_rate()
+        with self._lock:
+            self._total_bytes += n
+            if rate is None:
+                return
+            now = time.monotonic()
+            self._paid_until = max(self._paid_until, now - BURST_SECONDS) \
+                + n / rate
+            delay = self._paid_until - now
+        if delay > 0:
+            time.sleep(delay)
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._total_bytes
+
+
+_budget = BandwidthBudget()
+
+
+def configure_bandwidth(download_config: "DownloadConfig") -> None:
+    """Sets the rate (and time-of-day schedule) every download shares."""
+    _budget.get_rate = download_config.get_rate_limit
+
+
+def throttle(n: int) -> None:
+    """Records `n` downloaded bytes, blocking while over budget."""
+    _budget.consume(n)
+
+
+def get_transferred_bytes() -> int:
+    """Bytes downloaded in-process so far, limited or not."""
+    return _budget.total_bytes
+
+
+def get_rate_limit() -> Optional[float]:
+    return _budget.get_rate()
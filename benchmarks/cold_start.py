@@ -0,0 +1,108 @@
+"""Measures cold-start latency of each entry point: the time from
+spawning the script until its first visible action (launching mpv or
+sending a notification), or until it exits if it never acts.
+
+    python benchmarks/cold_start.py [--runs N]
+
+mpv and notify-send are replaced on PATH by shims that signal this
+process, and the scripts run against a throwaway data directory.
+"""
+import argparse
+import os
+from pathlib import Path
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+
+DOWNLOADED_URL = "https://www.youtube.com/watch?v=cold-start"
+MISSING_URL = "https://www.youtube.com/watch?v=missing"
+
+SCENARIOS = {
+    "python (baseline)": ["-c", "pass"],
+    "play (downloaded)": ["play.py", DOWNLOADED_URL],
+    "download (already downloaded)": ["download.py", DOWNLOADED_URL],
+    "delete (not found)": ["delete.py", MISSING_URL],
+    "update_database": ["update_database.py"],
+}
+
+SHIM = '#!/bin/sh\nkill -USR1 "$COLD_START_PID"\n'
+
+first_action: list[float] = []
+
+
+def on_action(*_: object) -> None:
+    first_action.append(time.perf_counter())
+
+
+def make_env(tmp: Path) -> dict[str, str]:
+    bin_dir = tmp / "bin"
+    bin_dir.mkdir()
+    for name in ("mpv", "notify-send", "terminal-notifier"):
+        shim = bin_dir / name
+        shim.write_text(SHIM)
+        shim.chmod(0o755)
+    env = os.environ.copy()
+    env["HOME"] = str(tmp / "home")
+    env["XDG_DATA_HOME"] = str(tmp / "data")
+    env["PATH"] = f"{bin_dir}{os.pathsep}{env['PATH']}"
+    env["COLD_START_PID"] = str(os.getpid())
+    return env
+
+
+def seed_database(env: dict[str, str]) -> None:
+    """Registers one downloaded video in the throwaway data directory."""
+    os.environ.update(env)  # constants resolve paths at import time
+    sys.path.insert(0, str(ROOT))
+    from constants import VIDEOS_DIR
+    from database import insert_video
+    from models import Metadata
+
+    video = VIDEOS_DIR / "Youtube" / "Bench" / "cold-start.mkv"
+    video.parent.mkdir(parents=True)
+    video.touch()
+    insert_video(video, Metadata(DOWNLOADED_URL, "cold start", "Bench"))
+
+
+def run_once(args: list[str], env: dict[str, str]) -> tuple[float, float]:
+    """Returns the seconds until the first action and until exit."""
+    first_action.clear()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, *args], cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    proc.wait()
+    end = time.perf_counter()
+    action = first_action[0] if first_action else end
+    return action - start, end - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGUSR1, on_action)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = make_env(Path(tmp))
+        seed_database(env)
+
+        print(f"{'entry point':<32}{'first action (ms)':>24}{'exit (ms)':>20}")
+        print(f"{'':<32}{'min':>12}{'median':>12}{'min':>10}{'median':>10}")
+        for name, script_args in SCENARIOS.items():
+            run_once(script_args, env)  # warm the OS and bytecode caches
+            results = [run_once(script_args, env) for _ in range(args.runs)]
+            actions = [a * 1e3 for a, _ in results]
+            exits = [e * 1e3 for _, e in results]
+            print(f"{name:<32}"
+                  f"{min(actions):>12.1f}{statistics.median(actions):>12.1f}"
+                  f"{min(exits):>10.1f}{statistics.median(exits):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+"""Runs the download paths end to end against local stand-ins and
+reports throughput, latency and peak RSS for each scenario.
+
+    python benchmarks/e2e.py [--items N] [--feeds N] [--downloads N]
+
+Everything runs offline in a throwaway data directory:
+
+- a synthetic Newsboat cache.db with --items items across --feeds feeds
+- a metadata.db with half of those items already downloaded
+- a local HTTP server serving a direct media file, an HLS (fMP4)
+  rendition of it and a fake Mediasite PlayerService
+
+Scenarios: `handle_single_download` (direct and HLS URLs), bulk
+downloads from a URL file and from a feed, and single Mediasite
+downloads of two streams each. Each runs in a fresh process, so its
+peak RSS is its own. Job latency comes from the recorded job spans.
+Requires ffmpeg on PATH.
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+from pathlib import Path
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SCENARIOS = ("single", "bulk-file", "bulk-feed", "mediasite")
+# Feeds holding each scenario's items; the rest are filler
+FEED_INDEXES = {"bulk-feed": 0, "bulk-file": 1, "single": 2, "mediasite": 3}
+MEDIASITE_PLAY_URL = "https://mediasite.video.ufl.edu/Mediasite/Play/"
+HLS_MIME_TYPE = "audio/x-mpegurl"  # what Mediasite labels HLS streams
+
+SHIM = "#!/bin/sh\nexit 0\n"
+
+NEWSBOAT_SCHEMA = """
+CREATE TABLE rss_feed (
+    rssurl VARCHAR(1024) PRIMARY KEY NOT NULL,
+    url VARCHAR(1024) NOT NULL,
+    title VARCHAR(1024) NOT NULL,
+    lastmodified INTEGER(11) NOT NULL DEFAULT 0,
+    is_rtl INTEGER(1) NOT NULL DEFAULT 0,
+    etag VARCHAR(128) NOT NULL DEFAULT ""
+);
+CREATE TABLE rss_item (
+    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    guid VARCHAR(64) NOT NULL,
+    title VARCHAR(1024) NOT NULL,
+    author VARCHAR(1024) NOT NULL,
+    url VARCHAR(1024) NOT NULL,
+    feedurl VARCHAR(1024) NOT NULL,
+    pubDate INTEGER NOT NULL,
+    content VARCHAR(65535) NOT NULL,
+    unread INTEGER(1) NOT NULL,
+    enclosure_url VARCHAR(1024),
+    enclosure_type VARCHAR(1024),
+    enqueued INTEGER(1) NOT NULL DEFAULT 0,
+    flags VARCHAR(52),
+    deleted INTEGER(1) NOT NULL DEFAULT 0,
+    base VARCHAR(128) NOT NULL DEFAULT "",
+    content_mime_type VARCHAR(255) NOT NULL DEFAULT "",
+    enclosure_description VARCHAR(1024) NOT NULL DEFAULT "",
+    enclosure_description_mime_type VARCHAR(128) NOT NULL DEFAULT ""
+);
+"""
+
+
+def feed_url(index: int) -> str:
+    return f"https://bench.invalid/feeds/{index}.xml"
+
+
+def feed_title(index: int) -> str:
+    return f"Channel {index}"
+
+
+# Stand-in server
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, www: Path, latency: float) -> None:
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.www = www
+        self.latency = latency
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # Clients hanging up mid-response (e.g. after a probe) are normal
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves /media/<any>.mp4, /hls/<any>/<file> and the PlayerService's
+    GetPlayerOptions. Any name works, so every URL is a distinct video
+    with the same contents.
+    """
+    server: StandInServer
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self) -> None:
+        self.do_GET(head=True)
+
+    def do_GET(self, head: bool = False) -> None:
+        time.sleep(self.server.latency)
+        path = self.path.split("?")[0]
+        hls_dir = self.server.www / "hls"
+        name = path.rsplit("/", 1)[-1]
+        if path.startswith("/media/") and path.endswith(".mp4"):
+            self.send_file(self.server.www / "media.mp4", "video/mp4", head)
+        elif path.startswith("/hls/") and name.endswith(".m3u8"):
+            self.send_file(hls_dir / "index.m3u8",
+                           "application/vnd.apple.mpegurl", head)
+        elif path.startswith("/hls/") and (hls_dir / name).is_file() \
+                and not name.startswith("."):
+            self.send_file(hls_dir / name, "video/mp4", head)
+        else:
+            self.send_error(404)
+
+    def do_POST(self) -> None:
+        time.sleep(self.server.latency)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.endswith("/json/GetPlayerOptions"):
+            self.send_error(404)
+            return
+        request = json.loads(body)["getPlayerOptionsRequest"]
+        resource_id = request["ResourceId"]
+        streams = [
+            {
+                "StreamType": stream_type,
+                "VideoUrls": [{
+                    "MimeType": HLS_MIME_TYPE,
+                    "Location": f"{self.server.base_url}/hls/"
+                                f"{resource_id}-{stream_type}/index.m3u8",
+                }],
+            }
+            for stream_type in (0, 2)
+        ]
+        data = json.dumps({"d": {"Presentation": {"Streams": streams}}})
+        self.send_bytes(data.encode(), "application/json")
+
+    def send_file(self, path: Path, content_type: str, head: bool) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(path.stat().st_size))
+        self.end_headers()
+        if not head:
+            with path.open("rb") as f:
+                while chunk := f.read(1 << 16):
+                    self.wfile.write(chunk)
+
+    def send_bytes(self, data: bytes, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+# Fixtures
+
+
+def make_media(www: Path, seconds: float) -> None:
+    """Writes a 720p H.264/AAC media.mp4 and an fMP4 HLS rendition."""
+    media = www / "media.mp4"
+    subprocess.run([
+        "ffmpeg", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=25:d={seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:d={seconds}",
+        "-codec:v", "libx264", "-preset", "ultrafast", "-g", "50",
+        "-b:v", "2M", "-codec:a", "aac",
+        "-movflags", "+faststart",
+        str(media),
+    ], check=True)
+    hls_dir = www / "hls"
+    hls_dir.mkdir()
+    subprocess.run([
+        "ffmpeg", "-loglevel", "error",
+        "-i", str(media),
+        "-codec", "copy",
+        "-f", "hls",
+        "-hls_time", "2",
+        "-hls_playlist_type", "vod",
+        "-hls_segment_type", "fmp4",
+        "-hls_fmp4_init_filename", "init.mp4",
+        "-hls_segment_filename", str(hls_dir / "seg%d.m4s"),
+        str(hls_dir / "index.m3u8"),
+    ], check=True)
+
+
+def make_scenario_urls(base_url: str, downloads: int) -> dict[str, list[str]]:
+    """URLs of the videos each scenario downloads."""
+    return {
+        "single": [
+            f"{base_url}/media/single-{i}.mp4" if i % 2 == 0
+            else f"{base_url}/hls/single-{i}/index.m3u8"
+            for i in range(downloads)
+        ],
+        "bulk-file": [f"{base_url}/media/file-{i}.mp4"
+                      for i in range(downloads)],
+        "bulk-feed": [f"{base_url}/media/feed-{i}.mp4"
+                      for i in range(downloads)],
+        "mediasite": [f"{MEDIASITE_PLAY_URL}{i:032x}"
+                      for i in range(downloads)],
+    }
+
+
+def build_newsboat_db(
+    path: Path,
+    feeds: int,
+    items: int,
+    scenario_urls: dict[str, list[str]],
+) -> list[tuple[int, str, str]]:
+    """Fills a Newsboat cache with filler items spread across `feeds`,
+    plus each scenario's items in its own feed. Returns the filler
+    items as (feed index, URL, title).
+    """
+    rng = random.Random(0)
+    filler = [
+        (i % feeds, f"https://www.youtube.com/watch?v={i:011d}", f"Video {i}")
+        for i in range(items)
+    ]
+    rows = [(feed, url, title) for feed, url, title in filler]
+    for name, urls in scenario_urls.items():
+        feed = FEED_INDEXES[name]
+        rows += [(feed, url, f"{name} {i}") for i, url in enumerate(urls)]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(NEWSBOAT_SCHEMA)
+    conn.executemany(
+        "INSERT INTO rss_feed (rssurl, url, title) VALUES (?, ?, ?);",
+        ((feed_url(i), feed_url(i), feed_title(i)) for i in range(feeds)),
+    )
+    now = int(time.time())
+    conn.executemany(
+        """
+        INSERT INTO rss_item (guid, title, author, url, feedurl, pubDate,
+                              content, unread)
+        VALUES (?, ?, ?, ?, ?, ?, '', ?);
+        """,
+        ((url, title, feed_title(feed), url, feed_url(feed),
+          now - rng.randrange(365 * 24 * 3600), int(rng.random() < 0.3))
+         for feed, url, title in rows),
+    )
+    # Only the scenario's items are unread in the bulk feed, so it never
+    # tries to download a filler item
+    conn.execute(
+        "UPDATE rss_item SET unread = url NOT LIKE ? WHERE feedurl = ?;",
+        ("https://www.youtube.com/%", feed_url(FEED_INDEXES["bulk-feed"])),
+    )
+    conn.commit()
+    conn.close()
+    return filler
+
+
+def seed_library(filler: list[tuple[int, str, str]]) -> list[str]:
+    """Registers every other filler item as downloaded. Files are only
+    created in the feeds the bulk scenarios check, since that's where
+    existence checks look. Returns the registered URLs of the bulk
+    file scenario's feed, for its URL list.
+    """
+    from constants import VIDEOS_DIR
+    from database import insert_video, transaction
+    from models import Metadata
+
+    checked_feeds = (FEED_INDEXES["bulk-feed"], FEED_INDEXES["bulk-file"])
+    file_urls = []
+    with transaction():
+        for i, (feed, url, title) in enumerate(filler):
+            if i % 2 == 1:
+                continue
+            path = VIDEOS_DIR / "Youtube" / feed_title(feed) / f"{title}.mkv"
+            insert_video(path, Metadata(url, title, feed_title(feed)))
+            if feed in checked_feeds:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.touch()
+            if feed == FEED_INDEXES["bulk-file"]:
+                file_urls.append(url)
+    return file_urls
+
+
+def make_env(tmp: Path, player_service_url: str) -> dict[str, str]:
+    bin_dir = tmp / "bin"
+    bin_dir.mkdir()
+    for name in ("notify-send", "terminal-notifier"):
+        shim = bin_dir / name
+        shim.write_text(SHIM)
+        shim.chmod(0o755)
+    env = os.environ.copy()
+    env["HOME"] = str(tmp / "home")
+    env["XDG_DATA_HOME"] = str(tmp / "data")
+    env["PATH"] = f"{bin_dir}{os.pathsep}{env['PATH']}"
+    env["VIDEO_MANAGER_PLAYER_SERVICE"] = \
+        f"{player_service_url}/Mediasite/PlayerService/PlayerService.svc"
+    return env
+
+
+# Scenario runner (child process)
+
+
+def run_scenario(name: str, state: dict[str, Any]) -> dict[str, Any]:
+    sys.path.insert(0, str(ROOT))
+    import mediasite
+    # Stands in for reading Firefox's cookie database
+    mediasite.read_cookie_string = lambda domain_filter: ""
+
+    from config import Config, DownloadConfig, FeaturesConfig
+    from database import get_spans_since
+    import download
+
+    config = Config(
+        download=DownloadConfig(),
+        features=FeaturesConfig(
+            custom_mediasite_handler=True, mediasite_all_streams=True
+        ),
+    )
+    started_at = time.time()
+    start = time.perf_counter()
+    if name in ("single", "mediasite"):
+        for url in state["urls"][name]:
+            try:
+                download.handle_single_download(url, config)
+            except SystemExit:
+                pass  # already reported
+    else:
+        try:
+            if name == "bulk-file":
+                download.handle_bulk_file_download(
+                    Path(state["url_file"]), config
+                )
+            else:
+                download.handle_bulk_feed_download(
+                    feed_url(FEED_INDEXES["bulk-feed"]), config,
+                    only_unread=True,
+                )
+        except SystemExit:
+            pass
+    wall = time.perf_counter() - start
+
+    jobs: dict[str, list] = {}
+    for span in get_spans_since(started_at):
+        jobs.setdefault(span.job_id, []).append(span)
+    completed = [
+        spans for spans in jobs.values()
+        if any(s.stage == "register" and s.ok for s in spans)
+    ]
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "jobs": len(jobs),
+        "completed": len(completed),
+        "wall": wall,
+        "bytes": sum(s.bytes or 0 for spans in completed for s in spans
+                     if s.stage == "fetch"),
+        "latencies": sorted(sum(s.duration for s in spans)
+                            for spans in completed),
+        # Kilobytes on Linux, bytes on macOS
+        "max_rss": max_rss * (1 if sys.platform == "darwin" else 1024),
+    }
+
+
+# Report
+
+
+def print_report(results: dict[str, dict[str, Any]]) -> None:
+    from stats import percentile
+
+    print(f"\n{'scenario':<12}{'done':>9}{'wall (s)':>10}{'jobs/s':>8}"
+          f"{'MB/s':>8}{'p50 (s)':>9}{'p95 (s)':>9}{'RSS (MB)':>10}")
+    for name, r in results.items():
+        wall = r["wall"]
+        latencies = r["latencies"] or [float("nan")]
+        print(f"{name:<12}{r['completed']:>5}/{r['jobs']:<3}{wall:>10.2f}"
+              f"{r['completed'] / wall:>8.2f}{r['bytes'] / wall / 1e6:>8.1f}"
+              f"{percentile(latencies, 50):>9.2f}"
+              f"{percentile(latencies, 95):>9.2f}"
+              f"{r['max_rss'] / 1e6:>10.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=100_000)
+    parser.add_argument("--feeds", type=int, default=200)
+    parser.add_argument("--downloads", type=int, default=8,
+                        help="videos downloaded per scenario")
+    parser.add_argument("--media-seconds", type=float, default=20)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every HTTP response")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS,
+                        default=list(SCENARIOS))
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the data directory and logs")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        state_path = Path(os.environ["E2E_STATE"])
+        state = json.loads(state_path.read_text())
+        result = run_scenario(args.child, state)
+        Path(os.environ["E2E_RESULT"]).write_text(json.dumps(result))
+        return
+
+    tmp_dir = tempfile.TemporaryDirectory(delete=not args.keep)
+    tmp = Path(tmp_dir.name)
+    www = tmp / "www"
+    www.mkdir()
+    print(f"Preparing fixtures in {tmp}")
+    make_media(www, args.media_seconds)
+    server = StandInServer(www, args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = make_env(tmp, server.base_url)
+
+    os.environ.update(env)  # constants resolve paths at import time
+    sys.path.insert(0, str(ROOT))
+    from constants import NEWSBOAT_DB_PATH
+
+    start = time.perf_counter()
+    urls = make_scenario_urls(server.base_url, args.downloads)
+    filler = build_newsboat_db(NEWSBOAT_DB_PATH, args.feeds, args.items, urls)
+    file_urls = seed_library(filler)
+    url_file = tmp / "urls.txt"
+    url_file.write_text("\n".join(file_urls + urls["bulk-file"]) + "\n")
+    print(f"Generated {args.items} items in {args.feeds} feeds "
+          f"({len(filler) // 2} downloaded) in "
+          f"{time.perf_counter() - start:.1f}s")
+
+    state_path = tmp / "state.json"
+    state_path.write_text(json.dumps({"urls": urls, "url_file": str(url_file)}))
+    results = {}
+    for name in args.scenarios:
+        result_path = tmp / f"{name}.json"
+        log_path = tmp / f"{name}.log"
+        print(f"Running {name}...")
+        with log_path.open("w") as log:
+            proc = subprocess.run(
+                [sys.executable, __file__, "--child", name],
+                cwd=ROOT, stdout=log, stderr=subprocess.STDOUT,
+                env={**env, "E2E_STATE": str(state_path),
+                     "E2E_RESULT": str(result_path)},
+            )
+        if proc.returncode != 0 or not result_path.is_file():
+            print(f"{name} failed; see {log_path}")
+            print("".join(log_path.read_text().splitlines(True)[-20:]))
+            continue
+        results[name] = json.loads(result_path.read_text())
+    server.shutdown()
+    print_report(results)
+    if args.keep:
+        print(f"\nData and logs kept in {tmp}")
+    else:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
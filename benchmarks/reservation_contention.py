@@ -0,0 +1,77 @@
+"""Measures download reservation throughput and latency while many
+processes race to reserve the same URLs.
+
+    python benchmarks/reservation_contention.py [--procs N] [--urls N]
+"""
+import argparse
+import multiprocessing
+from pathlib import Path
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+from models import Metadata  # noqa: E402
+
+
+def use_database(db_path: Path) -> None:
+    database.MANAGER_DATA_PATH = db_path.parent
+    database.MANAGER_METADATA_PATH = db_path
+
+
+def reserve_all(args: tuple[Path, list[str], int]) -> tuple[int, list[float]]:
+    """Tries to reserve every URL (in a random order), checking each one
+    the way `handle_single_download` does first. Returns the number of
+    reservations won and the latency of each attempt.
+    """
+    db_path, urls, seed = args
+    use_database(db_path)
+    urls = urls.copy()
+    random.Random(seed).shuffle(urls)
+    won = 0
+    latencies = []
+    for url in urls:
+        start = time.perf_counter()
+        if database.get_download_in_progress(url) is None:
+            if database.try_reserve_url(Metadata(url, url, "bench")):
+                won += 1
+        latencies.append(time.perf_counter() - start)
+    return won, latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--procs", type=int, default=16)
+    parser.add_argument("--urls", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "metadata.db"
+        use_database(db_path)
+        database.get_connection()  # migrate before the race starts
+
+        urls = [f"https://example.com/watch?v={i}" for i in range(args.urls)]
+        jobs = [(db_path, urls, seed) for seed in range(args.procs)]
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.procs) as pool:
+            results = pool.map(reserve_all, jobs)
+        elapsed = time.perf_counter() - start
+
+    won = sum(w for w, _ in results)
+    latencies = [l for _, ls in results for l in ls]
+    pct = statistics.quantiles(latencies, n=100)
+    print(f"processes:    {args.procs}")
+    print(f"attempts:     {len(latencies)} in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed:.0f}/s)")
+    print(f"latency (ms): p50 {pct[49] * 1e3:.2f}  p95 {pct[94] * 1e3:.2f}  "
+          f"p99 {pct[98] * 1e3:.2f}  max {max(latencies) * 1e3:.2f}")
+    print(f"reserved:     {won}/{len(urls)} URLs "
+          f"({'ok' if won == len(urls) else 'DOUBLE RESERVATIONS'})")
+
+
+if __name__ == "__main__":
+    main()
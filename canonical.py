@@ -0,0 +1,79 @@
+import re
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+
+YOUTUBE_HOST_PATTERN = re.compile(
+    r"(www\.|m\.|music\.)?(youtube\.com|youtube-nocookie\.com)"
+)
+YOUTUBE_PATH_PATTERN = re.compile(r"/(shorts|embed|live|v)/([\w-]{11})")
+YOUTUBE_ID_PATTERN = re.compile(r"[\w-]{11}")
+MEDIASITE_HOST = "mediasite.video.ufl.edu"
+
+
+def make_canonical_id(extractor_key: str, video_id: str) -> str:
+    """Formats an identity the way yt-dlp's download archive does, e.g.
+    "youtube dQw4w9WgXcQ".
+    """
+    return f"{extractor_key.lower()} {video_id}"
+
+
+def get_youtube_id(url: str) -> Optional[str]:
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+    if host == "youtu.be":
+        video_id = parsed.path.strip("/").split("/")[0]
+    elif YOUTUBE_HOST_PATTERN.fullmatch(host):
+        match = YOUTUBE_PATH_PATTERN.match(parsed.path)
+        if match is not None:
+            video_id = match.group(2)
+        elif parsed.path == "/watch":
+            video_id = parse_qs(parsed.query).get("v", [""])[0]
+        else:
+            return None
+    else:
+        return None
+    return video_id if YOUTUBE_ID_PATTERN.fullmatch(video_id) else None
+
+
+def get_mediasite_id(url: str) -> Optional[str]:
+    parsed = urlparse(url)
+    if parsed.netloc.lower() != MEDIASITE_HOST:
+        return None
+    resource_id = parsed.path.rstrip("/").split("/")[-1]
+    return resource_id.lower() or None
+
+
+def get_canonical_id(url: str) -> Optional[str]:
+    """Returns the identity of the video at `url` for the sites whose
+    URLs encode it, without importing yt-dlp. Every variant of a
+    YouTube link (youtu.be, Shorts, timestamps, playlists) maps to the
+    same identity.
+    """
+    youtube_id = get_youtube_id(url)
+    if youtube_id is not None:
+        return make_canonical_id("Youtube", youtube_id)
+    mediasite_id = get_mediasite_id(url)
+    if mediasite_id is not None:
+        return make_canonical_id("Mediasite", mediasite_id)
+    return None
+
+
+def get_canonical_id_with_yt_dlp(url: str) -> Optional[str]:
+    """Like `get_canonical_id`, but falls back to matching `url` against
+    yt-dlp's extractors. Slow the first time, as every extractor is
+    loaded; no network requests are made.
+    """
+    canonical_id = get_canonical_id(url)
+    if canonical_id is not None:
+        return canonical_id
+    from yt_dlp.extractor import gen_extractor_classes
+
+    for ie in gen_extractor_classes():
+        if ie.ie_key() == "Generic" or not ie.suitable(url):
+            continue
+        video_id = ie.get_temp_id(url)
+        if video_id is not None:
+            return make_canonical_id(ie.ie_key(), video_id)
+        return None
+    return None
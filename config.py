@@ -1,25 +1,110 @@
+from datetime import datetime, time
 from pathlib import Path
 from typing import Optional
 from pydantic import BaseModel, Field
 import toml
 
 from constants import CONFIG_PATH
+from models import LinkType
 from util import send_notif
 
 
+MIB = 1 << 20
+
+
+class RateWindow(BaseModel):
+    # Local times of day; a window ending before it starts wraps midnight
+    start: time
+    end: time
+    # MiB/s shared by all running downloads; 0 means unlimited
+    rate_limit: float = Field(ge=0)
+
+    def contains(self, t: time) -> bool:
+        if self.start <= self.end:
+            return self.start <= t < self.end
+        return t >= self.start or t < self.end
+
+
 class DownloadConfig(BaseModel):
     use_yt_dlp_cli: bool = Field(default=False)
     yt_dlp_path: str = Field(default="yt-dlp")
+    max_concurrent_downloads: int = Field(default=4, ge=1)
+    max_concurrent_resolves: int = Field(default=8, ge=1)
+    # Workers tagging/re-encoding fetched videos while others download
+    max_concurrent_postprocess: int = Field(default=2, ge=1)
+    # Jobs each bulk pipeline stage queues beyond its running workers
+    stage_queue_size: int = Field(default=8, ge=0)
+    # Interrupted downloads older than this are deleted instead of resumed
+    partial_max_age_days: float = Field(default=7.0, ge=0)
+    # Keyed by lowercase `LinkType` name, e.g. {"mediasite": 1}
+    link_type_limits: dict[str, int] = Field(default_factory=dict)
+    # Dump a cProfile of each job stage to the profiles directory
+    profile_jobs: bool = Field(default=False)
+    # MiB/s shared by all running downloads; 0 means unlimited
+    rate_limit: float = Field(default=0.0, ge=0)
+    # Overrides `rate_limit` during the times of day they cover
+    rate_schedule: list[RateWindow] = Field(default_factory=list)
+    # Vary the number of concurrent downloads (up to
+    # max_concurrent_downloads) by whether extra ones raise throughput
+    adaptive_concurrency: bool = Field(default=False)
+
+    def get_link_type_limit(self, link_type: LinkType) -> int:
+        """Returns how many downloads of the given link type may run
+        at once (never more than the global limit).
+        """
+        limit = self.link_type_limits.get(link_type.name.lower())
+        if limit is None:
+            return self.max_concurrent_downloads
+        return max(1, min(limit, self.max_concurrent_downloads))
+
+    def get_rate_limit(
+        self, now: Optional[datetime] = None
+    ) -> Optional[float]:
+        """Returns the bandwidth budget in effect at `now` (default: the
+        current time) in bytes per second, or None if unlimited.
+        """
+        t = (now or datetime.now()).time()
+        rate_limit = next(
+            (window.rate_limit for window in self.rate_schedule
+             if window.contains(t)),
+            self.rate_limit,
+        )
+        return rate_limit * MIB if rate_limit > 0 else None
 
 
 class FeaturesConfig(BaseModel):
     custom_mediasite_handler: bool = Field(default=False)
+    # Mux every Mediasite stream (e.g. camera and screen) into one file
+    mediasite_all_streams: bool = Field(default=False)
     zoom_reencoding: bool = Field(default=False)
+    # libx264 settings for Zoom re-encoding
+    zoom_preset: str = Field(default="medium")
+    zoom_crf: int = Field(default=23, ge=0, le=51)
+    # Cores the chunked encoder may use; 0 means all of them
+    zoom_encode_cores: int = Field(default=0, ge=0)
+
+
+class WatchFeedConfig(BaseModel):
+    url: str
+    # Also enqueue new items that were already marked read
+    include_read: bool = Field(default=False)
+    # Only enqueue items whose title matches this regex
+    title_pattern: Optional[str] = Field(default=None)
+
+
+class WatchConfig(BaseModel):
+    poll_interval: float = Field(default=60.0, gt=0)
+    # Failed downloads before an item is given up on
+    max_attempts: int = Field(default=5, ge=1)
+    # Seconds before retrying a failed item, doubling after each failure
+    retry_backoff: float = Field(default=300.0, ge=0)
+    feeds: list[WatchFeedConfig] = Field(default_factory=list)
 
 
 class Config(BaseModel):
     features: FeaturesConfig
     download: DownloadConfig
+    watch: WatchConfig = Field(default_factory=WatchConfig)
 
 
 def load_config(config_path: Path) -> Optional[Config]:
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 import platformdirs
 
@@ -8,6 +9,10 @@ NEWSBOAT_DB_PATH = Path(platformdirs.user_data_dir()) / "newsboat" / "cache.db"
 
 MANAGER_DATA_PATH = Path(platformdirs.user_data_dir()) / "video-manager"
 MANAGER_METADATA_PATH = MANAGER_DATA_PATH / "metadata.db"
+PROFILES_DIR = MANAGER_DATA_PATH / "profiles"
+DAEMON_SOCKET_PATH = Path(
+    os.environ.get("VIDEO_MANAGER_SOCKET", MANAGER_DATA_PATH / "daemon.sock")
+)
 
 SCRIPT_DIR = Path(__file__).parent
 CONFIG_PATH = SCRIPT_DIR / "config.toml"
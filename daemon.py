@@ -0,0 +1,157 @@
+from pathlib import Path
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from typing import NoReturn
+
+from config import Config, load_config
+from constants import CONFIG_PATH, DAEMON_SOCKET_PATH
+from download import handle_single_download, start_adaptive_concurrency
+from models import LinkType
+from scheduler import DownloadScheduler
+from util import get_link_type, send_notif
+
+# Clients send one command per connection and read the reply until EOF:
+#
+#   download <URL>  ->  "queued <URL>" or "duplicate <URL>"
+#   status          ->  one "<state>\t<URL>" line per job
+
+
+class DownloadManager:
+    """Owns the download queue for every client. Jobs run through
+    `handle_single_download` on a long-lived worker pool, so imports,
+    config and yt-dlp extractors stay warm between submissions.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        link_type_limits = {
+            link_type: config.download.get_link_type_limit(link_type)
+            for link_type in LinkType
+        }
+        self.scheduler = DownloadScheduler[str](
+            config.download.max_concurrent_downloads, link_type_limits
+        )
+        self.controller = start_adaptive_concurrency(self.scheduler, config)
+        self.lock = threading.Lock()
+        self.jobs: dict[str, str] = {}
+
+    def set_state(self, url: str, state: str) -> None:
+        with self.lock:
+            self.jobs[url] = state
+
+    def run_job(self, url: str) -> None:
+        self.set_state(url, "running")
+        try:
+            handle_single_download(
+                url,
+                self.config,
+                self.scheduler.cancel_event,
+                self.config.download.max_concurrent_downloads,
+            )
+        except SystemExit:
+            self.set_state(url, "failed")
+            return
+        except Exception as e:
+            send_notif("Error", f"Error downloading video: {url} {e}")
+            self.set_state(url, "failed")
+            return
+        self.set_state(url, "done")
+
+    def submit(self, url: str) -> str:
+        with self.lock:
+            if self.jobs.get(url) in ("queued", "running"):
+                return "duplicate"
+            self.jobs[url] = "queued"
+        self.scheduler.submit(url, get_link_type(url), self.run_job, url)
+        # Outcomes are tracked in `jobs`; just release finished futures
+        for _ in self.scheduler.completed(block=False):
+            pass
+        return "queued"
+
+    def status(self) -> list[str]:
+        with self.lock:
+            return [f"{state}\t{url}" for url, state in self.jobs.items()]
+
+    def shutdown(self) -> None:
+        if self.controller is not None:
+            self.controller.stop()
+        self.scheduler.cancel()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    server: "DaemonServer"
+
+    def handle(self) -> None:
+        line = self.rfile.readline().decode().strip()
+        if not line:
+            return  # a liveness probe (see is_daemon_running)
+        command, _, arg = line.partition(" ")
+        manager = self.server.manager
+        if command == "download" and arg:
+            reply = [f"{manager.submit(arg)} {arg}"]
+        elif command == "status" and not arg:
+            reply = manager.status()
+        else:
+            reply = [f"error unknown command: {line}"]
+        try:
+            self.wfile.write("".join(f"{r}\n" for r in reply).encode())
+        except ConnectionError:
+            pass  # the client left without reading the reply
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, manager: DownloadManager) -> None:
+        self.manager = manager
+        super().__init__(str(socket_path), RequestHandler)
+
+
+def is_daemon_running(socket_path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+    return True
+
+
+def raise_interrupt(*_: object) -> NoReturn:
+    raise KeyboardInterrupt
+
+
+def main() -> None:
+    config = load_config(CONFIG_PATH)
+    if config is None:
+        sys.exit(1)
+    if len(sys.argv) != 1:
+        send_notif("Error", f"Invalid Arguments: {sys.argv[1:]}")
+        sys.exit(1)
+
+    if is_daemon_running(DAEMON_SOCKET_PATH):
+        print(f"Daemon already listening on {DAEMON_SOCKET_PATH}",
+              file=sys.stderr)
+        sys.exit(1)
+    DAEMON_SOCKET_PATH.parent.mkdir(parents=True, exist_ok=True)
+    DAEMON_SOCKET_PATH.unlink(missing_ok=True)  # left by a crashed daemon
+
+    signal.signal(signal.SIGTERM, raise_interrupt)
+    manager = DownloadManager(config)
+    with DaemonServer(DAEMON_SOCKET_PATH, manager) as server:
+        print(f"Listening on {DAEMON_SOCKET_PATH}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("Shutting down")
+        finally:
+            # A second SIGTERM kills the daemon without waiting for jobs
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            DAEMON_SOCKET_PATH.unlink(missing_ok=True)
+            manager.shutdown()
+
+
+if __name__ == "__main__":
+    main()
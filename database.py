@@ -1,51 +1,390 @@
+from contextlib import contextmanager
+import json
+import os
 from pathlib import Path
+import socket
 import sqlite3
-from typing import Optional
+import threading
+import time
+from typing import Iterable, Iterator, Optional
+import uuid
 
+from canonical import get_canonical_id
 from constants import MANAGER_DATA_PATH, MANAGER_METADATA_PATH
-from models import Metadata
-from util import get_pid_and_stime, process_exists
-
-
-MANAGER_DATA_PATH.mkdir(parents=True, exist_ok=True)
-conn = sqlite3.connect(MANAGER_METADATA_PATH)
-cur = conn.cursor()
-
-cur.executescript("""
-CREATE TABLE IF NOT EXISTS videos (
-    url TEXT NOT NULL UNIQUE PRIMARY KEY,
-    path TEXT NOT NULL UNIQUE,
-    title TEXT NOT NULL,
-    artist TEXT NOT NULL
-);
-
-CREATE TABLE IF NOT EXISTS downloads_in_progress (
-    url TEXT PRIMARY KEY,
-    title TEXT NOT NULL,
-    artist TEXT NOT NULL,
-    pid INTEGER NOT NULL,
-    start_time REAL NOT NULL
-);
-""")
-conn.commit()
-
-
-def insert_video(path: Path, metadata: Metadata) -> None:
-    cur.execute(
-        """
-        INSERT INTO videos (path, url, title, artist)
-        VALUES (?, ?, ?, ?);
-        """,
-        (str(path), metadata.url, metadata.title, metadata.artist),
-    )
+from models import (
+    LibraryFile,
+    LinkType,
+    Metadata,
+    PartialDownload,
+    Span,
+    VideoDetails,
+)
+
+
+# How long a connection waits on another process's write lock (seconds)
+BUSY_TIMEOUT = 30.0
+
+# Download reservations are leases: they expire unless their holder
+# keeps renewing them, so a crashed process's reservations free
+# themselves without any liveness checks.
+LEASE_TTL = 60.0  # seconds
+LEASE_HEARTBEAT_INTERVAL = LEASE_TTL / 3
+
+
+
+def new_holder_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+# Identifies the leases held by this process
+HOLDER_ID = new_holder_id()
+
+# Schema migrations, applied in order. The database's `user_version`
+# records how many have run, so each one only ever runs once. Never
+# edit an existing entry; append a new one instead.
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS videos (
+        url TEXT NOT NULL UNIQUE PRIMARY KEY,
+        path TEXT NOT NULL UNIQUE,
+        title TEXT NOT NULL,
+        artist TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS downloads_in_progress (
+        url TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        artist TEXT NOT NULL,
+        pid INTEGER NOT NULL,
+        start_time REAL NOT NULL
+    );
+    """,
+    # Explicit integer ids give the full-text index stable rowids.
+    # The triggers keep it in sync with every write to `videos`.
+    """
+    CREATE TABLE videos_new (
+        id INTEGER PRIMARY KEY,
+        url TEXT NOT NULL UNIQUE,
+        path TEXT NOT NULL UNIQUE,
+        title TEXT NOT NULL,
+        artist TEXT NOT NULL
+    );
+    INSERT INTO videos_new (url, path, title, artist)
+        SELECT url, path, title, artist FROM videos;
+    DROP TABLE videos;
+    ALTER TABLE videos_new RENAME TO videos;
+
+    CREATE INDEX videos_artist_title ON videos (artist, title);
+
+    CREATE VIRTUAL TABLE videos_fts USING fts5 (
+        title,
+        artist,
+        content='videos',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    );
+    INSERT INTO videos_fts (videos_fts) VALUES ('rebuild');
+
+    CREATE TRIGGER videos_fts_insert AFTER INSERT ON videos BEGIN
+        INSERT INTO videos_fts (rowid, title, artist)
+        VALUES (new.id, new.title, new.artist);
+    END;
+
+    CREATE TRIGGER videos_fts_delete AFTER DELETE ON videos BEGIN
+        INSERT INTO videos_fts (videos_fts, rowid, title, artist)
+        VALUES ('delete', old.id, old.title, old.artist);
+    END;
+
+    CREATE TRIGGER videos_fts_update AFTER UPDATE ON videos BEGIN
+        INSERT INTO videos_fts (videos_fts, rowid, title, artist)
+        VALUES ('delete', old.id, old.title, old.artist);
+        INSERT INTO videos_fts (rowid, title, artist)
+        VALUES (new.id, new.title, new.artist);
+    END;
+    """,
+    """
+    DROP TABLE downloads_in_progress;
+    CREATE TABLE downloads_in_progress (
+        url TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        artist TEXT NOT NULL,
+        holder TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX downloads_in_progress_expires_at
+        ON downloads_in_progress (expires_at);
+    """,
+    # Journal of interrupted downloads whose partial files are kept
+    # around so the next attempt can resume them.
+    """
+    CREATE TABLE partial_downloads (
+        url TEXT PRIMARY KEY,
+        temp_path TEXT NOT NULL,
+        format_id TEXT,
+        bytes_done INTEGER NOT NULL DEFAULT 0,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX partial_downloads_updated_at
+        ON partial_downloads (updated_at);
+    """,
+    # Highest Newsboat `rss_item.id` already handled per watched feed
+    """
+    CREATE TABLE newsboat_watch (
+        rssurl TEXT PRIMARY KEY,
+        last_item_id INTEGER NOT NULL
+    );
+    """,
+    # Files seen by the last library rescan, so unchanged files don't
+    # need their tags parsed again. Looked up by identity to find files
+    # that were moved or renamed.
+    """
+    CREATE TABLE library_files (
+        path TEXT PRIMARY KEY,
+        inode INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        url TEXT,
+        title TEXT,
+        artist TEXT
+    );
+    CREATE INDEX library_files_identity
+        ON library_files (inode, size, mtime_ns);
+    """,
+    # Stream details, recorded at download time. Existing rows are
+    # backfilled by the next library rescan, which caches the details it
+    # parses in library_files alongside the tags.
+    """
+    ALTER TABLE videos ADD COLUMN size INTEGER;
+    ALTER TABLE videos ADD COLUMN duration REAL;
+    ALTER TABLE videos ADD COLUMN container TEXT;
+    ALTER TABLE videos ADD COLUMN video_codec TEXT;
+    ALTER TABLE videos ADD COLUMN audio_codec TEXT;
+    ALTER TABLE videos ADD COLUMN width INTEGER;
+    ALTER TABLE videos ADD COLUMN height INTEGER;
+    ALTER TABLE videos ADD COLUMN format_id TEXT;
+    ALTER TABLE videos ADD COLUMN downloaded_at REAL;
+    ALTER TABLE library_files ADD COLUMN has_details INTEGER NOT NULL
+        DEFAULT 0;
+    ALTER TABLE library_files ADD COLUMN duration REAL;
+    ALTER TABLE library_files ADD COLUMN container TEXT;
+    ALTER TABLE library_files ADD COLUMN video_codec TEXT;
+    ALTER TABLE library_files ADD COLUMN audio_codec TEXT;
+    ALTER TABLE library_files ADD COLUMN width INTEGER;
+    ALTER TABLE library_files ADD COLUMN height INTEGER;
+    """,
+    # Videos are identified by their (extractor, video ID) rather than
+    # the URL they were downloaded from, with every URL seen for a video
+    # recorded as an alias. Not unique, so that duplicates downloaded
+    # before this can be found (see dedupe.py) rather than rejected.
+    """
+    ALTER TABLE videos ADD COLUMN canonical_id TEXT;
+    CREATE INDEX videos_canonical_id ON videos (canonical_id);
+    CREATE TABLE url_aliases (
+        url TEXT PRIMARY KEY,
+        canonical_id TEXT NOT NULL
+    );
+    """,
+    # How long each download job spent in each stage, for stats.py
+    """
+    CREATE TABLE job_spans (
+        id INTEGER PRIMARY KEY,
+        job_id TEXT NOT NULL,
+        url TEXT NOT NULL,
+        link_type TEXT NOT NULL,
+        artist TEXT,
+        stage TEXT NOT NULL,
+        started_at REAL NOT NULL,
+        duration REAL NOT NULL,
+        bytes INTEGER,
+        ok INTEGER NOT NULL
+    );
+    CREATE INDEX job_spans_started_at ON job_spans (started_at);
+    """,
+    # Identify the entries registered before canonical IDs were, where
+    # the URL alone says which video it is (see get_connection for the
+    # canonical_id function); dedupe.py covers the rest with yt-dlp
+    """
+    UPDATE videos SET canonical_id = canonical_id(url)
+        WHERE canonical_id IS NULL;
+    INSERT OR IGNORE INTO url_aliases (url, canonical_id)
+        SELECT url, canonical_id FROM videos
+        WHERE canonical_id IS NOT NULL;
+    """,
+    # Watched feed items that failed to download, so they are retried
+    # with backoff and eventually given up on
+    """
+    CREATE TABLE watch_failures (
+        url TEXT PRIMARY KEY,
+        attempts INTEGER NOT NULL,
+        last_attempt REAL NOT NULL
+    );
+    """,
+]
+
+# Connections are per thread so worker pools can use the database
+# without sharing a connection.
+_local = threading.local()
+
+_heartbeat_lock = threading.Lock()
+_heartbeat: Optional[threading.Thread] = None
+
+
+def reset_after_fork() -> None:
+    """Forked children must not reuse the parent's connections, lease
+    identity or heartbeat thread.
+    """
+    global _local, _heartbeat, _heartbeat_lock, HOLDER_ID
+    _local = threading.local()
+    _heartbeat = None
+    _heartbeat_lock = threading.Lock()
+    HOLDER_ID = new_holder_id()
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def split_statements(script: str) -> Iterator[str]:
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ""
+
+
+def migrate(conn: sqlite3.Connection) -> None:
+    """Brings the schema up to date. Concurrent processes serialize on
+    the write lock, so only the first one applies each migration.
+    """
+    version = conn.execute("PRAGMA user_version;").fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        version = conn.execute("PRAGMA user_version;").fetchone()[0]
+        for script in MIGRATIONS[version:]:
+            for statement in split_statements(script):
+                conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)};")
+    except BaseException:
+        conn.rollback()
+        raise
     conn.commit()
 
 
-def get_video(url: str) -> tuple[Optional[Path], Optional[Metadata]]:
-    cur.execute(
-        "SELECT path, url, title, artist FROM videos WHERE url = ?;", (url,)
-    )
-    row = cur.fetchone()
+def get_connection() -> sqlite3.Connection:
+    """Returns this thread's connection, opening it (and migrating the
+    schema) on first use.
+    """
+    conn: Optional[sqlite3.Connection] = getattr(_local, "conn", None)
+    if conn is None:
+        MANAGER_DATA_PATH.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            MANAGER_METADATA_PATH,
+            timeout=BUSY_TIMEOUT,
+            isolation_level=None,  # transactions are managed explicitly
+        )
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("PRAGMA synchronous = NORMAL;")
+        conn.create_function(
+            "canonical_id", 1, get_canonical_id, deterministic=True
+        )
+        migrate(conn)
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Cursor]:
+    """Groups writes into a single transaction that commits on exit and
+    rolls back on error. Nested uses join the outermost transaction, so
+    a bulk caller can wrap many single-row writes in one commit.
+    """
+    conn = get_connection()
+    if conn.in_transaction:
+        yield conn.cursor()
+        return
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        yield conn.cursor()
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def add_url_alias(url: str, canonical_id: str) -> None:
+    with transaction() as cur:
+        cur.execute(
+            "INSERT OR REPLACE INTO url_aliases (url, canonical_id) "
+            "VALUES (?, ?);",
+            (url, canonical_id),
+        )
+
+
+def lookup_canonical_id(url: str) -> Optional[str]:
+    """Returns the identity of the video at `url`, from the URL itself
+    or from an alias recorded when it was last resolved.
+    """
+    canonical_id = get_canonical_id(url)
+    if canonical_id is not None:
+        return canonical_id
+    row = get_connection().execute(
+        "SELECT canonical_id FROM url_aliases WHERE url = ?;", (url,)
+    ).fetchone()
+    return None if row is None else row[0]
+
+
+def insert_video(
+    path: Path, metadata: Metadata, details: Optional[VideoDetails] = None
+) -> None:
+    details = details or VideoDetails()
+    canonical_id = metadata.canonical_id or get_canonical_id(metadata.url)
+    with transaction() as cur:
+        cur.execute(
+            """
+            INSERT INTO videos (
+                path, url, title, artist, size, duration, container,
+                video_codec, audio_codec, width, height, format_id,
+                downloaded_at, canonical_id
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+            """,
+            (str(path), metadata.url, metadata.title, metadata.artist,
+             details.size, details.duration, details.container,
+             details.video_codec, details.audio_codec, details.width,
+             details.height, details.format_id, details.downloaded_at,
+             canonical_id),
+        )
+        if canonical_id is not None:
+            add_url_alias(metadata.url, canonical_id)
+
+
+def get_video(
+    url: str, canonical_id: Optional[str] = None
+) -> tuple[Optional[Path], Optional[Metadata]]:
+    """Finds the entry for `url` by its canonical identity (looked up
+    unless given), falling back to the exact URL for entries whose
+    identity isn't known.
+    """
+    conn = get_connection()
+    canonical_id = canonical_id or lookup_canonical_id(url)
+    row = None
+    if canonical_id is not None:
+        row = conn.execute(
+            """
+            SELECT path, url, title, artist FROM videos
+            WHERE canonical_id = ?
+            ORDER BY id
+            LIMIT 1;
+            """,
+            (canonical_id,),
+        ).fetchone()
+    if row is None:
+        row = conn.execute(
+            "SELECT path, url, title, artist FROM videos WHERE url = ?;",
+            (url,),
+        ).fetchone()
     if row is None:
         # print("Video not found")
         return None, None
@@ -64,45 +403,376 @@ def get_video(url: str) -> tuple[Optional[Path], Optional[Metadata]]:
     return path, metadata
 
 
+def list_dir_names(dir_path: Path) -> set[str]:
+    try:
+        return set(os.listdir(dir_path))
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
+
+
+def get_downloaded_urls(urls: Iterable[str]) -> set[str]:
+    """Returns the subset of `urls` that are already downloaded, under
+    that URL or any other with the same canonical identity.
+
+    Uses a single query for the whole batch and checks file existence
+    with one directory listing per parent directory. Entries whose files
+    have been deleted are removed in a single transaction.
+    """
+    urls = list(urls)
+    urls_by_id: dict[str, list[str]] = {}
+    for url in urls:
+        canonical_id = get_canonical_id(url)
+        if canonical_id is not None:
+            urls_by_id.setdefault(canonical_id, []).append(url)
+    conn = get_connection()
+    urls_json = json.dumps(urls)
+    for url, canonical_id in conn.execute(
+        """
+        SELECT url, canonical_id FROM url_aliases
+        WHERE url IN (SELECT value FROM json_each(?));
+        """,
+        (urls_json,),
+    ):
+        if url not in urls_by_id.get(canonical_id, []):
+            urls_by_id.setdefault(canonical_id, []).append(url)
+    cur = conn.execute(
+        """
+        SELECT path, url, title, artist, canonical_id FROM videos
+        WHERE url IN (SELECT value FROM json_each(?))
+            OR canonical_id IN (SELECT value FROM json_each(?));
+        """,
+        (urls_json, json.dumps(list(urls_by_id))),
+    )
+    rows = cur.fetchall()
+    requested = set(urls)
+    dir_listings: dict[Path, set[str]] = {}
+    downloaded = set()
+    stale = []
+    for path_str, url, title, artist, canonical_id in rows:
+        path = Path(path_str)
+        names = dir_listings.get(path.parent)
+        if names is None:
+            names = dir_listings[path.parent] = list_dir_names(path.parent)
+        if path.name in names:
+            if url in requested:
+                downloaded.add(url)
+            downloaded.update(urls_by_id.get(canonical_id, ()))
+        else:
+            print(f"Removing deleted entry: {artist} - {title}")
+            stale.append((url,))
+    if stale:
+        with transaction() as cur:
+            cur.executemany("DELETE FROM videos WHERE url = ?;", stale)
+    return downloaded
+
+
+def row_to_video(row: tuple[str, str, str, str]) -> tuple[Path, Metadata]:
+    path, url, title, artist = row
+    return Path(path), Metadata(url=url, title=title, artist=artist)
+
+
 def get_all_videos() -> list[tuple[Path, Metadata]]:
-    cur.execute("SELECT path, url, title, artist FROM videos;")
-    videos = []
-    for path, url, title, artist in cur.fetchall():
-        videos.append((
-            Path(path),
-            Metadata(
-                url=url,
-                title=title,
-                artist=artist,
-            ),
-        ))
-    return videos
+    cur = get_connection().execute(
+        "SELECT path, url, title, artist FROM videos;"
+    )
+    return [row_to_video(row) for row in cur.fetchall()]
+
+
+def to_fts_query(query: str) -> str:
+    """Turns free text into an FTS5 query matching every word as a
+    prefix, so user input can't trip over FTS syntax.
+    """
+    words = query.replace('"', " ").split()
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_videos(
+    query: str,
+    limit: Optional[int] = None,
+) -> Iterator[tuple[Path, Metadata]]:
+    """Yields library entries whose title or artist match `query`,
+    best match first.
+    """
+    fts_query = to_fts_query(query)
+    if not fts_query:
+        return
+    cur = get_connection().execute(
+        """
+        SELECT v.path, v.url, v.title, v.artist
+        FROM videos_fts f
+        JOIN videos v ON v.id = f.rowid
+        WHERE videos_fts MATCH ?
+        ORDER BY f.rank
+        LIMIT ?;
+        """,
+        (fts_query, -1 if limit is None else limit),
+    )
+    for row in cur:
+        yield row_to_video(row)
+
+
+def get_artists() -> Iterator[tuple[str, int]]:
+    """Yields every artist in the library with its video count."""
+    cur = get_connection().execute(
+        "SELECT artist, count(*) FROM videos GROUP BY artist ORDER BY artist;"
+    )
+    yield from cur
+
+
+def get_videos_by_artist(artist: str) -> Iterator[tuple[Path, Metadata]]:
+    cur = get_connection().execute(
+        """
+        SELECT path, url, title, artist FROM videos
+        WHERE artist = ?
+        ORDER BY title;
+        """,
+        (artist,),
+    )
+    for row in cur:
+        yield row_to_video(row)
+
+
+def get_urls_without_canonical_id() -> list[str]:
+    cur = get_connection().execute(
+        "SELECT url FROM videos WHERE canonical_id IS NULL;"
+    )
+    return [url for url, in cur]
+
+
+def set_canonical_ids(ids: Iterable[tuple[str, str]]) -> None:
+    """Records the canonical identity of entries, given as (url, id)."""
+    ids = list(ids)
+    with transaction() as cur:
+        cur.executemany(
+            "UPDATE videos SET canonical_id = ? WHERE url = ?;",
+            ((canonical_id, url) for url, canonical_id in ids),
+        )
+        cur.executemany(
+            "INSERT OR REPLACE INTO url_aliases (url, canonical_id) "
+            "VALUES (?, ?);",
+            ids,
+        )
+
+
+def get_duplicate_videos() -> list[list[tuple[Path, Metadata]]]:
+    """Groups the entries sharing a canonical identity, each group in
+    the order the entries were registered.
+    """
+    cur = get_connection().execute(
+        """
+        SELECT path, url, title, artist, canonical_id FROM videos
+        WHERE canonical_id IN (
+            SELECT canonical_id FROM videos
+            WHERE canonical_id IS NOT NULL
+            GROUP BY canonical_id
+            HAVING count(*) > 1
+        )
+        ORDER BY canonical_id, id;
+        """
+    )
+    groups: dict[str, list[tuple[Path, Metadata]]] = {}
+    for path, url, title, artist, canonical_id in cur:
+        groups.setdefault(canonical_id, []).append(
+            (Path(path), Metadata(url, title, artist, canonical_id))
+        )
+    return list(groups.values())
 
 
 def delete_video(url: str) -> None:
-    cur.execute("DELETE FROM videos WHERE url = ?;", (url,))
-    conn.commit()
+    with transaction() as cur:
+        cur.execute("DELETE FROM videos WHERE url = ?;", (url,))
+
+
+def update_video_path(url: str, path: str) -> None:
+    with transaction() as cur:
+        cur.execute("UPDATE videos SET path = ? WHERE url = ?;", (path, url))
 
 
-def remove_stale_entries() -> None:
-    """Deletes rows whose PID is no longer running or whose
-    creation_time doesn't match.
+def get_videos_missing_details() -> list[tuple[Path, str]]:
+    """Returns the (path, url) of entries without stream details."""
+    cur = get_connection().execute(
+        "SELECT path, url FROM videos WHERE size IS NULL;"
+    )
+    return [(Path(path), url) for path, url in cur]
+
+
+def update_video_details(url: str, details: VideoDetails) -> None:
+    """Sets an entry's stream details, keeping any format ID or download
+    time it already has.
     """
-    cur.execute("SELECT url, pid, start_time FROM downloads_in_progress")
-    for url, pid, stime in cur.fetchall():
-        if not process_exists(pid, stime):
-            cur.execute(
-                "DELETE FROM downloads_in_progress WHERE url = ?",
-                (url,)
+    with transaction() as cur:
+        cur.execute(
+            """
+            UPDATE videos SET
+                size = ?, duration = ?, container = ?, video_codec = ?,
+                audio_codec = ?, width = ?, height = ?,
+                format_id = coalesce(format_id, ?),
+                downloaded_at = coalesce(downloaded_at, ?)
+            WHERE url = ?;
+            """,
+            (details.size, details.duration, details.container,
+             details.video_codec, details.audio_codec, details.width,
+             details.height, details.format_id, details.downloaded_at, url),
+        )
+
+
+LIBRARY_FILE_COLUMNS = """
+    path, inode, size, mtime_ns, url, title, artist, has_details,
+    duration, container, video_codec, audio_codec, width, height
+"""
+
+
+def row_to_library_file(row: tuple) -> LibraryFile:
+    path, inode, size, mtime_ns, url, title, artist, has_details, \
+        duration, container, video_codec, audio_codec, width, height = row
+    tags = None if url is None else Metadata(url, title, artist)
+    details = None
+    if has_details:
+        details = VideoDetails(size, duration, container, video_codec,
+                               audio_codec, width, height)
+    return LibraryFile(Path(path), inode, size, mtime_ns, tags, details)
+
+
+def library_file_to_row(f: LibraryFile) -> tuple:
+    tags = ((f.tags.url, f.tags.title, f.tags.artist)
+            if f.tags is not None else (None, None, None))
+    details = f.details or VideoDetails()
+    return (str(f.path), f.inode, f.size, f.mtime_ns,
+            *tags, f.details is not None,
+            details.duration, details.container, details.video_codec,
+            details.audio_codec, details.width, details.height)
+
+
+def get_library_files() -> list[LibraryFile]:
+    cur = get_connection().execute(
+        f"SELECT {LIBRARY_FILE_COLUMNS} FROM library_files;"
+    )
+    return [row_to_library_file(row) for row in cur]
+
+
+def get_library_file(
+    inode: int, size: int, mtime_ns: int
+) -> Optional[LibraryFile]:
+    """Looks up a cached file by identity, whatever its path."""
+    cur = get_connection().execute(
+        f"""
+        SELECT {LIBRARY_FILE_COLUMNS} FROM library_files
+        WHERE inode = ? AND size = ? AND mtime_ns = ?
+        LIMIT 1;
+        """,
+        (inode, size, mtime_ns),
+    )
+    row = cur.fetchone()
+    return None if row is None else row_to_library_file(row)
+
+
+def save_library_file(f: LibraryFile) -> None:
+    with transaction() as cur:
+        cur.execute(
+            f"""
+            INSERT OR REPLACE INTO library_files ({LIBRARY_FILE_COLUMNS})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+            """,
+            library_file_to_row(f),
+        )
+
+
+def sync_library_files(files: list[LibraryFile]) -> int:
+    """Saves the files seen by a rescan and deletes the rows of every
+    path it didn't see (removed files, files read from outside the
+    library). Returns how many rows were deleted.
+    """
+    with transaction() as cur:
+        cur.executemany(
+            f"""
+            INSERT OR REPLACE INTO library_files ({LIBRARY_FILE_COLUMNS})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+            """,
+            (library_file_to_row(f) for f in files),
+        )
+        cur.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS seen_paths "
+            "(path TEXT PRIMARY KEY);"
+        )
+        cur.executemany(
+            "INSERT OR IGNORE INTO seen_paths (path) VALUES (?);",
+            ((str(f.path),) for f in files),
+        )
+        cur.execute(
+            """
+            DELETE FROM library_files
+            WHERE path NOT IN (SELECT path FROM seen_paths);
+            """
+        )
+        deleted = cur.rowcount
+        cur.execute("DELETE FROM seen_paths;")
+    return deleted
+
+
+def move_library_file(old_path: Path, new_path: Path) -> None:
+    """Re-keys a cached file that was renamed."""
+    with transaction() as cur:
+        cur.execute(
+            "UPDATE OR REPLACE library_files SET path = ? WHERE path = ?;",
+            (str(new_path), str(old_path)),
+        )
+
+
+def delete_library_file(path: Path) -> None:
+    with transaction() as cur:
+        cur.execute("DELETE FROM library_files WHERE path = ?;", (str(path),))
+
+
+def renew_leases() -> None:
+    """Extends every lease held by this process."""
+    with transaction() as cur:
+        cur.execute(
+            """
+            UPDATE downloads_in_progress SET expires_at = ?
+            WHERE holder = ?
+            """,
+            (time.time() + LEASE_TTL, HOLDER_ID),
+        )
+
+
+def run_lease_heartbeat() -> None:
+    while True:
+        time.sleep(LEASE_HEARTBEAT_INTERVAL)
+        try:
+            renew_leases()
+        except sqlite3.Error as e:
+            print(f"Error renewing download reservations: {e}")
+
+
+def start_lease_heartbeat() -> None:
+    """Starts the background thread that keeps this process's leases
+    alive. It dies with the process, after which its leases expire.
+    """
+    global _heartbeat
+    with _heartbeat_lock:
+        if _heartbeat is None:
+            _heartbeat = threading.Thread(
+                target=run_lease_heartbeat,
+                name="lease-heartbeat",
+                daemon=True,
             )
-    conn.commit()
+            _heartbeat.start()
+
+
+def get_reservation_key(url: str) -> str:
+    """Reservations are keyed by identity where the URL gives it, so
+    two variants of one URL can't be downloaded at once.
+    """
+    return get_canonical_id(url) or url
 
 
 def get_download_in_progress(url: str) -> Optional[Metadata]:
-    remove_stale_entries()
-    cur.execute(
-        "SELECT title, artist FROM downloads_in_progress WHERE url = ?",
-        (url,)
+    cur = get_connection().execute(
+        """
+        SELECT title, artist FROM downloads_in_progress
+        WHERE url = ? AND expires_at >= ?
+        """,
+        (get_reservation_key(url), time.time())
     )
     row = cur.fetchone()
     if row is None:
@@ -115,27 +785,183 @@ def try_reserve_url(metadata: Metadata) -> bool:
     """Returns True if we successfully reserved this URL for download,
    False if it is already in-progress.
    """
-    remove_stale_entries()
-    pid, stime = get_pid_and_stime()
-    try:
+    now = time.time()
+    with transaction() as cur:
+        cur.execute(
+            "DELETE FROM downloads_in_progress WHERE expires_at < ?",
+            (now,)
+        )
         cur.execute(
             """
-            INSERT INTO downloads_in_progress(url, title, artist,
-                                              pid, start_time)
+            INSERT OR IGNORE INTO downloads_in_progress(url, title, artist,
+                                                        holder, expires_at)
             VALUES (?, ?, ?, ?, ?);
             """,
-            (metadata.url, metadata.title, metadata.artist, pid, stime),
+            (get_reservation_key(metadata.url), metadata.title,
+             metadata.artist, HOLDER_ID, now + LEASE_TTL),
         )
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        # Download already in-progress
-        return False
+        reserved = cur.rowcount == 1
+    if reserved:
+        start_lease_heartbeat()
+    return reserved
 
 
 def clear_reservation(url: str) -> None:
-    cur.execute(
-        "DELETE FROM downloads_in_progress WHERE url = ?",
-        (url,)
+    with transaction() as cur:
+        cur.execute(
+            "DELETE FROM downloads_in_progress WHERE url = ? AND holder = ?",
+            (get_reservation_key(url), HOLDER_ID)
+        )
+
+
+def save_partial_download(
+    url: str,
+    temp_path: Path,
+    format_id: Optional[str] = None,
+    bytes_done: Optional[int] = None,
+) -> None:
+    """Creates or refreshes the journal entry for a download. Fields
+    passed as None keep their journaled value.
+    """
+    with transaction() as cur:
+        cur.execute(
+            """
+            INSERT INTO partial_downloads (url, temp_path, format_id,
+                                           bytes_done, updated_at)
+            VALUES (?, ?, ?, coalesce(?, 0), ?)
+            ON CONFLICT (url) DO UPDATE SET
+                temp_path = excluded.temp_path,
+                format_id = coalesce(?, format_id),
+                bytes_done = coalesce(?, bytes_done),
+                updated_at = excluded.updated_at;
+            """,
+            (url, str(temp_path), format_id, bytes_done, time.time(),
+             format_id, bytes_done),
+        )
+
+
+def get_partial_download(url: str) -> Optional[PartialDownload]:
+    cur = get_connection().execute(
+        """
+        SELECT url, temp_path, format_id, bytes_done, updated_at
+        FROM partial_downloads WHERE url = ?;
+        """,
+        (url,),
     )
-    conn.commit()
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return PartialDownload(*row)
+
+
+def get_partial_downloads_before(timestamp: float) -> list[PartialDownload]:
+    cur = get_connection().execute(
+        """
+        SELECT url, temp_path, format_id, bytes_done, updated_at
+        FROM partial_downloads WHERE updated_at < ?;
+        """,
+        (timestamp,),
+    )
+    return [PartialDownload(*row) for row in cur.fetchall()]
+
+
+def delete_partial_download(url: str) -> None:
+    with transaction() as cur:
+        cur.execute("DELETE FROM partial_downloads WHERE url = ?;", (url,))
+
+
+def get_watch_position(rssurl: str) -> Optional[int]:
+    cur = get_connection().execute(
+        "SELECT last_item_id FROM newsboat_watch WHERE rssurl = ?;",
+        (rssurl,),
+    )
+    row = cur.fetchone()
+    return None if row is None else row[0]
+
+
+def set_watch_position(rssurl: str, last_item_id: int) -> None:
+    with transaction() as cur:
+        cur.execute(
+            """
+            INSERT INTO newsboat_watch (rssurl, last_item_id) VALUES (?, ?)
+            ON CONFLICT (rssurl) DO UPDATE SET
+                last_item_id = excluded.last_item_id;
+            """,
+            (rssurl, last_item_id),
+        )
+
+
+def get_watch_failures(urls: Iterable[str]) -> dict[str, tuple[int, float]]:
+    """Returns the failed attempt count and the time of the last failure
+    for each of `urls` that has failed.
+    """
+    conn = get_connection()
+    failures = {}
+    for url in urls:
+        row = conn.execute(
+            "SELECT attempts, last_attempt FROM watch_failures WHERE url = ?;",
+            (url,),
+        ).fetchone()
+        if row is not None:
+            failures[url] = (row[0], row[1])
+    return failures
+
+
+def record_watch_failure(url: str) -> int:
+    """Counts a failed attempt at `url` and returns how many there were."""
+    with transaction() as cur:
+        cur.execute(
+            """
+            INSERT INTO watch_failures (url, attempts, last_attempt)
+            VALUES (?, 1, ?)
+            ON CONFLICT (url) DO UPDATE SET
+                attempts = attempts + 1,
+                last_attempt = excluded.last_attempt;
+            """,
+            (url, time.time()),
+        )
+        row = cur.execute(
+            "SELECT attempts FROM watch_failures WHERE url = ?;", (url,)
+        ).fetchone()
+    return row[0]
+
+
+def clear_watch_failures(urls: Iterable[str]) -> None:
+    with transaction() as cur:
+        cur.executemany(
+            "DELETE FROM watch_failures WHERE url = ?;",
+            ((url,) for url in urls),
+        )
+
+
+def insert_span(span: Span) -> None:
+    with transaction() as cur:
+        cur.execute(
+            """
+            INSERT INTO job_spans (job_id, url, link_type, artist, stage,
+                                   started_at, duration, bytes, ok)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+            """,
+            (span.job_id, span.url, span.link_type.name, span.artist,
+             span.stage, span.started_at, span.duration, span.bytes,
+             span.ok),
+        )
+
+
+def get_spans_since(timestamp: float) -> list[Span]:
+    cur = get_connection().execute(
+        """
+        SELECT job_id, url, link_type, stage, started_at, duration, artist,
+               bytes, ok
+        FROM job_spans
+        WHERE started_at >= ?
+        ORDER BY started_at;
+        """,
+        (timestamp,),
+    )
+    return [
+        Span(job_id, url, LinkType[link_type], stage, started_at, duration,
+             artist, size, bool(ok))
+        for job_id, url, link_type, stage, started_at, duration, artist,
+            size, ok in cur
+    ]
@@ -0,0 +1,153 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from pathlib import Path
+import sys
+from typing import Optional
+
+from canonical import get_canonical_id_with_yt_dlp
+from database import (
+    add_url_alias,
+    delete_video,
+    get_all_videos,
+    get_duplicate_videos,
+    get_urls_without_canonical_id,
+    lookup_canonical_id,
+    set_canonical_ids,
+    transaction,
+)
+from models import Metadata
+from util import remove_dir_if_empty
+
+
+# hashlib releases the GIL while hashing, so reads and hashes overlap
+HASH_WORKERS = 4
+HASH_CHUNK_SIZE = 1 << 20
+
+type Video = tuple[Path, Metadata]
+
+
+def backfill_canonical_ids() -> int:
+    """Gives entries registered before canonical IDs were recorded their
+    identity. Returns how many were identified.
+    """
+    ids = []
+    for url in get_urls_without_canonical_id():
+        canonical_id = get_canonical_id_with_yt_dlp(url)
+        if canonical_id is not None:
+            ids.append((url, canonical_id))
+    set_canonical_ids(ids)
+    return len(ids)
+
+
+def hash_file(path: Path) -> Optional[str]:
+    h = hashlib.blake2b()
+    try:
+        with path.open("rb") as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def get_size(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return None
+
+
+def hash_videos(videos: list[Video]) -> dict[Path, str]:
+    """Hashes every file whose size matches another file's, since only
+    those can have identical contents.
+    """
+    by_size: dict[int, list[Path]] = {}
+    for path, _ in videos:
+        size = get_size(path)
+        if size is not None:
+            by_size.setdefault(size, []).append(path)
+    paths = [path for group in by_size.values() if len(group) > 1
+             for path in group]
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        digests = pool.map(hash_file, paths)
+    return {path: digest for path, digest in zip(paths, digests)
+            if digest is not None}
+
+
+def find_content_duplicates(
+    videos: list[Video], digests: dict[Path, str]
+) -> list[list[Video]]:
+    groups: dict[str, list[Video]] = {}
+    for video in videos:
+        digest = digests.get(video[0])
+        if digest is not None:
+            groups.setdefault(digest, []).append(video)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def is_identical(path: Path, other: Path, digests: dict[Path, str]) -> bool:
+    digest = digests.get(path)
+    return digest is not None and digest == digests.get(other)
+
+
+def remove_copies(keeper: Video, copies: list[Video]) -> None:
+    """Deletes `copies` of `keeper`, keeping their URLs as aliases."""
+    _, metadata = keeper
+    canonical_id = metadata.canonical_id or lookup_canonical_id(metadata.url)
+    with transaction():
+        for path, metadata in copies:
+            delete_video(metadata.url)
+            if canonical_id is not None:
+                add_url_alias(metadata.url, canonical_id)
+    for path, metadata in copies:
+        print(f"Removed: {path}")
+        path.unlink(missing_ok=True)
+        remove_dir_if_empty(path.parent)
+
+
+def main() -> None:
+    args = set(sys.argv[1:])
+    if not args <= {"--hash", "--remove"}:
+        print("Invalid arguments.", file=sys.stderr)
+        print("\tFormat: [--hash] [--remove]", file=sys.stderr)
+        sys.exit(1)
+    check_hash = "--hash" in args
+    remove = "--remove" in args
+
+    print(f"Identified {backfill_canonical_ids()} entries")
+    groups = get_duplicate_videos()
+    digests: dict[Path, str] = {}
+    if check_hash:
+        videos = get_all_videos()
+        digests = hash_videos(videos)
+        seen = {path for group in groups for path, _ in group}
+        # Identical files registered under unrelated identities
+        groups += [
+            group for group in find_content_duplicates(videos, digests)
+            if not seen.issuperset(path for path, _ in group)
+        ]
+
+    removed = 0
+    for keeper, *copies in groups:
+        print(f"\n{keeper[1].artist} - {keeper[1].title}")
+        print(f"  keep:   {keeper[0]} ({keeper[1].url})")
+        for path, metadata in copies:
+            note = ""
+            if check_hash:
+                same = is_identical(path, keeper[0], digests)
+                note = " [identical]" if same else " [differs]"
+            print(f"  copy:   {path} ({metadata.url}){note}")
+        if remove:
+            # With --hash, only copies proven identical are removed
+            if check_hash:
+                copies = [
+                    (path, metadata) for path, metadata in copies
+                    if is_identical(path, keeper[0], digests)
+                ]
+            remove_copies(keeper, copies)
+            removed += len(copies)
+    print(f"\n{len(groups)} duplicate groups, {removed} copies removed")
+
+
+if __name__ == "__main__":
+    main()
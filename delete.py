@@ -16,7 +16,7 @@ def main() -> None:
         if file_path:
             file_path.unlink(missing_ok=True)
             remove_dir_if_empty(file_path.parent)
-        delete_video(url)
+        delete_video(metadata.url)
         send_notif("Deleted Video", metadata.title)
     else:
         send_notif("Failed to Delete Video", f"Video not found: {url}")
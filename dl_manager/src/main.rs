@@ -1,3 +1,65 @@
-fn main() {
-    println!("This is a download manager");
+use std::env;
+use std::io::{self, Read, Write};
+use std::net::Shutdown;
+use std::os::unix::net::UnixStream;
+use std::path::PathBuf;
+use std::process::ExitCode;
+
+const USAGE: &str = "Usage: dl_manager <URL>\n       dl_manager --status";
+
+/// Mirrors `DAEMON_SOCKET_PATH` in constants.py.
+fn socket_path() -> Option<PathBuf> {
+    if let Some(path) = env::var_os("VIDEO_MANAGER_SOCKET") {
+        return Some(PathBuf::from(path));
+    }
+    let data_dir = if cfg!(target_os = "macos") {
+        PathBuf::from(env::var_os("HOME")?).join("Library/Application Support")
+    } else if let Some(dir) = env::var_os("XDG_DATA_HOME").filter(|d| !d.is_empty()) {
+        PathBuf::from(dir)
+    } else {
+        PathBuf::from(env::var_os("HOME")?).join(".local/share")
+    };
+    Some(data_dir.join("video-manager").join("daemon.sock"))
+}
+
+/// Sends one command to the daemon and returns its reply.
+fn send_command(path: &PathBuf, command: &str) -> io::Result<String> {
+    let mut stream = UnixStream::connect(path)?;
+    stream.write_all(format!("{command}\n").as_bytes())?;
+    stream.shutdown(Shutdown::Write)?;
+    let mut reply = String::new();
+    stream.read_to_string(&mut reply)?;
+    Ok(reply)
+}
+
+fn main() -> ExitCode {
+    let args: Vec<String> = env::args().skip(1).collect();
+    let command = match args.as_slice() {
+        [flag] if flag == "--status" => "status".to_string(),
+        [url] if !url.starts_with('-') => format!("download {url}"),
+        _ => {
+            eprintln!("{USAGE}");
+            return ExitCode::FAILURE;
+        }
+    };
+    let Some(path) = socket_path() else {
+        eprintln!("Could not determine the daemon socket path");
+        return ExitCode::FAILURE;
+    };
+
+    match send_command(&path, &command) {
+        Ok(reply) => {
+            print!("{reply}");
+            if reply.starts_with("error") {
+                ExitCode::FAILURE
+            } else {
+                ExitCode::SUCCESS
+            }
+        }
+        Err(e) => {
+            eprintln!("Could not reach daemon at {}: {e}", path.display());
+            eprintln!("Start it with: python daemon.py");
+            ExitCode::FAILURE
+        }
+    }
 }
@@ -1,35 +1,84 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import replace
+import hashlib
+import itertools
 from pathlib import Path
+import queue
+import shlex
+import shutil
 import subprocess
 import sys
-import yt_dlp
-from yt_dlp.utils import sanitize_filename
-
-from config import Config, load_config
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from bandwidth import (
+    configure_bandwidth,
+    get_rate_limit,
+    get_transferred_bytes,
+    throttle,
+)
+from canonical import get_canonical_id_with_yt_dlp, make_canonical_id
 from constants import CONFIG_PATH, VIDEOS_DIR
 from database import (
+    add_url_alias,
     clear_reservation,
+    delete_library_file,
+    delete_partial_download,
     get_download_in_progress,
+    get_downloaded_urls,
+    get_partial_download,
+    get_partial_downloads_before,
+    get_reservation_key,
     get_video,
     insert_video,
+    move_library_file,
+    save_partial_download,
+    transaction,
     try_reserve_url,
 )
-from mediasite import download_mediasite_video, get_mediasite_metadata
-from models import LinkType, Metadata
+from encode import encode_chunked
+from mediasite import (
+    download_mediasite_video,
+    get_mediasite_file_path,
+    get_mediasite_metadata,
+)
+from library import read_video_file
+from models import BulkJob, BulkSummary, LinkType, Metadata, VideoDetails
 from newsboat import (
-    fetch_newsboat_feed_and_items,
+    fetch_newsboat_feed,
+    fetch_newsboat_items,
     get_metadata_from_newsboat,
+    iter_newsboat_feed_items,
+    newsboat_to_video_metadata,
+)
+from pipeline import Stage, print_stage_report
+from scheduler import AdaptiveConcurrency, DownloadScheduler
+from timing import new_job_id, record_span
+from util import (
+    get_link_type,
+    get_metadata_args,
+    read_urls_from_file,
+    send_notif,
 )
-from util import get_link_type, read_urls_from_file, send_notif
 
+# yt-dlp and the pydantic config are imported where they're used so
+# that fast paths (e.g. "already downloaded") don't pay for loading them
+if TYPE_CHECKING:
+    import yt_dlp
+    from config import Config
 
-def get_encoding_args(link_type: LinkType, config: Config) -> list[str]:
-    if link_type == LinkType.ZOOM and config.features.zoom_reencoding:
-        return [
-            "-codec:v", "libx264",
-            "-codec:a", "copy",
-        ]
-    else:
-        return ["-codec", "copy"]
+
+# Base name yt-dlp writes to inside a video's temp directory
+TEMP_VIDEO_NAME = "video"
+
+DEFAULT_FORMAT = "bestvideo[height<=2160]+bestaudio/best"
+
+_local = threading.local()
+
+
+def needs_reencode(link_type: LinkType, config: "Config") -> bool:
+    return link_type == LinkType.ZOOM and config.features.zoom_reencoding
 
 
 def set_props(
@@ -37,21 +86,28 @@ def set_props(
     out_path: Path,
     metadata: Metadata,
     link_type: LinkType,
-    config: Config,
+    config: "Config",
 ) -> None:
-    encoding_args = get_encoding_args(link_type, config)
     out_path.parent.mkdir(parents=True, exist_ok=True)
     try:
-        subprocess.run([
-            "ffmpeg",
-            "-y",  # overwrite destination file without asking
-            "-i", in_path,
-            "-metadata", f"URL={metadata.url}",
-            "-metadata", f"title={metadata.title}",
-            "-metadata", f"artist={metadata.artist}",
-            *encoding_args,
-            out_path,
-        ], check=False)
+        if needs_reencode(link_type, config):
+            encode_chunked(
+                in_path,
+                out_path,
+                get_metadata_args(metadata),
+                config.features.zoom_preset,
+                config.features.zoom_crf,
+                config.features.zoom_encode_cores,
+            )
+        else:
+            subprocess.run([
+                "ffmpeg",
+                "-y",  # overwrite destination file without asking
+                "-i", in_path,
+                *get_metadata_args(metadata),
+                "-codec", "copy",
+                out_path,
+            ], check=False)
     except subprocess.CalledProcessError as e:
         err_msg = str(e) if e.stderr is None else e.stderr.decode()
         send_notif(
@@ -67,6 +123,8 @@ def set_props(
 
 
 def get_file_path_from_info(info: dict[str, str], link_type: LinkType) -> Path:
+    from yt_dlp.utils import sanitize_filename
+
     if link_type == LinkType.ZOOM:
         base_name = sanitize_filename(f'zoom-{info["id"]}')
     elif link_type == LinkType.INSTAGRAM:
@@ -83,51 +141,212 @@ def get_file_path_from_info(info: dict[str, str], link_type: LinkType) -> Path:
     return file_path
 
 
-def get_temp_path(file_path: Path) -> Path:
-    return file_path.with_suffix(".tmp" + file_path.suffix)
+def get_temp_dir(file_path: Path, url: str) -> Path:
+    """Directory yt-dlp downloads and merges into before the finished
+    video is moved (renamed) to `file_path`. Named after the video's
+    reservation key rather than its title, so videos that share a title
+    and uploader never share (or resume from) each other's fragments.
+    """
+    key = get_reservation_key(url).encode()
+    digest = hashlib.blake2b(key, digest_size=8).hexdigest()
+    return file_path.with_name(f".{digest}.tmp")
+
+
+def get_dir_size(dir_path: Path) -> int:
+    return sum(p.stat().st_size for p in dir_path.iterdir() if p.is_file())
+
+
+def cleanup_partial_downloads(config: "Config") -> None:
+    """Deletes journaled partial downloads that haven't been touched
+    in `partial_max_age_days`.
+    """
+    max_age = config.download.partial_max_age_days * 24 * 60 * 60
+    for partial in get_partial_downloads_before(time.time() - max_age):
+        if get_download_in_progress(partial.url) is not None:
+            continue
+        print(f"Removing stale partial download: {partial.url}")
+        shutil.rmtree(partial.temp_path, ignore_errors=True)
+        delete_partial_download(partial.url)
+
+
+def has_props(file_path: Path, metadata: Metadata) -> bool:
+    props = read_video_file(file_path).tags
+    return props is not None and props.url == metadata.url
+
+
+def get_video_details(
+    file_path: Path, format_id: Optional[str]
+) -> VideoDetails:
+    """Details to register a finished download with. The file was
+    usually parsed by `has_props` before being renamed into place, so
+    this is a cache hit.
+    """
+    details = VideoDetails(format_id=format_id, downloaded_at=time.time())
+    try:
+        f = read_video_file(file_path)
+    except OSError:
+        return details
+    if f.details is None:
+        return replace(details, size=f.size)
+    return replace(f.details, size=f.size, format_id=format_id,
+                   downloaded_at=details.downloaded_at)
+
+
+def get_extraction_ydl() -> "yt_dlp.YoutubeDL":
+    """Returns this thread's YoutubeDL for metadata extraction, so
+    long-lived processes keep a warm instance instead of building one
+    per URL.
+    """
+    import yt_dlp
+
+    ydl: Optional[yt_dlp.YoutubeDL] = getattr(_local, "ydl", None)
+    if ydl is None:
+        ydl = _local.ydl = yt_dlp.YoutubeDL()
+    return ydl
 
 
 def get_metadata_with_yt_dlp(url: str) -> tuple[Path, Metadata]:
+    import yt_dlp
+
     link_type = get_link_type(url)
-    with yt_dlp.YoutubeDL() as ydl:
-        try:
-            info = ydl.extract_info(url, download=False)
-        except yt_dlp.DownloadError as e:
-            send_notif("Error", f"Error downloading video: {url} {e.msg}")
-            sys.exit(1)
+    try:
+        info = get_extraction_ydl().extract_info(url, download=False)
+    except yt_dlp.DownloadError as e:
+        send_notif("Error", f"Error downloading video: {url} {e.msg}")
+        sys.exit(1)
     if info is None:
         send_notif("Error", f"Error locating video: {url}")
         sys.exit(1)
+    canonical_id = None
+    if info.get("extractor_key") and info.get("id"):
+        canonical_id = make_canonical_id(info["extractor_key"], info["id"])
     metadata = Metadata(
         url=url,
         title=info.get("title", info.get("id", "Unknown")),
         artist=info.get("uploader", "Unknown"),
+        canonical_id=canonical_id,
     )
     file_path = get_file_path_from_info(info, link_type)
     return file_path, metadata
 
 
-def get_metadata(url: str, config: Config) -> tuple[Path, Metadata]:
+def get_metadata(
+    url: str,
+    config: "Config",
+    newsboat_metadata: Optional[Metadata] = None,
+    skip_newsboat: bool = False,
+) -> tuple[Path, Metadata]:
+    """Resolves the metadata and target path for `url`. Callers that
+    already loaded the Newsboat item can pass its metadata to skip the
+    lookup, or `skip_newsboat` if they already know it isn't there.
+    """
     is_mediasite = get_link_type(url) == LinkType.MEDIASITE
     if is_mediasite and config.features.custom_mediasite_handler:
-        return get_mediasite_metadata(url)
+        if newsboat_metadata is None and not skip_newsboat:
+            return get_mediasite_metadata(url)
+        if newsboat_metadata is None:
+            send_notif("Error extracting metadata", "Newsboat data not found")
+            sys.exit(1)
+        return get_mediasite_file_path(newsboat_metadata), newsboat_metadata
 
-    metadata = get_metadata_from_newsboat(url)
+    metadata = newsboat_metadata
+    if metadata is None and not skip_newsboat:
+        metadata = get_metadata_from_newsboat(url)
     if metadata is None:
         return get_metadata_with_yt_dlp(url)
 
+    from yt_dlp.utils import sanitize_filename
+
+    canonical_id = get_canonical_id_with_yt_dlp(url)
+    metadata = replace(metadata, canonical_id=canonical_id)
     dir_name = sanitize_filename(metadata.artist)
     file_name = f"{sanitize_filename(metadata.title)}.mkv"
     file_path = VIDEOS_DIR / "Youtube" / dir_name / file_name
     return file_path, metadata
 
 
+def make_cancel_hook(cancel_event: threading.Event):
+    """Returns a yt-dlp progress hook that aborts the download once
+    `cancel_event` is set.
+    """
+    from yt_dlp.utils import DownloadCancelled
+
+    def hook(_: dict[str, Any]) -> None:
+        if cancel_event.is_set():
+            raise DownloadCancelled()
+    return hook
+
+
+def make_format_hook(url: str, temp_dir: Path):
+    """Returns a yt-dlp progress hook that journals which formats are
+    being downloaded, so a resumed download picks the same streams.
+    """
+    format_ids: list[str] = []
+
+    def hook(d: dict[str, Any]) -> None:
+        format_id = d.get("info_dict", {}).get("format_id")
+        if format_id and format_id not in format_ids:
+            format_ids.append(format_id)
+            save_partial_download(url, temp_dir, "+".join(format_ids))
+    return hook
+
 
-def download_with_yt_dlp_lib(metadata: Metadata, file_path: Path) -> None:
-    ydl_opts = {
-        "format": "bestvideo[height<=2160]+bestaudio/best",
+def make_bandwidth_hook():
+    """Returns a yt-dlp progress hook that charges the bytes received
+    to the shared bandwidth budget, stalling the download while over it.
+    """
+    # Bytes reported so far per file; the first report is a baseline,
+    # as resumed downloads start counting from their partial size
+    reported: dict[str, int] = {}
+
+    def hook(d: dict[str, Any]) -> None:
+        if d.get("status") != "downloading":
+            return
+        filename = d.get("filename", "")
+        done = d.get("downloaded_bytes") or 0
+        previous = reported.get(filename)
+        reported[filename] = done
+        if previous is not None and done > previous:
+            throttle(done - previous)
+    return hook
+
+
+def download_with_yt_dlp_lib(
+    metadata: Metadata,
+    temp_dir: Path,
+    format_spec: Optional[str] = None,
+    cancel_event: Optional[threading.Event] = None,
+) -> None:
+    """Downloads into `temp_dir`, writing the URL/title/artist tags in
+    the same ffmpeg pass that merges (or remuxes) the streams to MKV.
+
+    yt-dlp continues any `.part` files already in `temp_dir`. Unless
+    `format_spec` pins the formats of a resumed download, the formats
+    chosen are journaled for the next attempt.
+    """
+    import yt_dlp
+
+    metadata_args = get_metadata_args(metadata)
+    progress_hooks = [make_bandwidth_hook()]
+    if format_spec is None:
+        format_spec = DEFAULT_FORMAT
+        progress_hooks.append(make_format_hook(metadata.url, temp_dir))
+    if cancel_event is not None:
+        progress_hooks.append(make_cancel_hook(cancel_event))
+    ydl_opts: dict[str, Any] = {
+        "format": format_spec,
         "merge_output_format": "mkv",
-        "outtmpl": str(file_path),
+        "paths": {"home": str(temp_dir), "temp": str(temp_dir)},
+        "outtmpl": f"{TEMP_VIDEO_NAME}.%(ext)s",
+        "postprocessors": [{
+            "key": "FFmpegVideoRemuxer",
+            "preferedformat": "mkv",
+        }],
+        "postprocessor_args": {
+            "merger+ffmpeg_o": metadata_args,
+            "videoremuxer+ffmpeg_o": metadata_args,
+        },
+        "progress_hooks": progress_hooks,
         "embed-metadata": True,
         "embed-chapters": True,
     }
@@ -143,15 +362,32 @@ def download_with_yt_dlp_lib(metadata: Metadata, file_path: Path) -> None:
 
 def download_with_yt_dlp_cli(
     metadata: Metadata,
-    file_path: Path,
-    config: Config,
+    temp_dir: Path,
+    config: "Config",
+    format_spec: Optional[str] = None,
+    concurrent_downloads: int = 1,
 ) -> None:
+    """`concurrent_downloads` is how many downloads may be sharing the
+    rate limit at once.
+    """
+    metadata_args = shlex.join(get_metadata_args(metadata))
+    # A separate process can't draw from the shared budget, so each
+    # download gets an even share of the rate in effect when it starts
+    rate_limit = config.download.get_rate_limit()
+    rate_args = [] if rate_limit is None else [
+        "--limit-rate", str(int(rate_limit / concurrent_downloads)),
+    ]
     try:
         subprocess.run([
             config.download.yt_dlp_path,
-            "-f", "bestvideo[height<=2160]+bestaudio/best",
+            *rate_args,
+            "-f", format_spec or DEFAULT_FORMAT,
             "--merge-output-format", "mkv",
-            "-o", file_path,
+            "--remux-video", "mkv",
+            "--postprocessor-args", f"Merger+ffmpeg_o:{metadata_args}",
+            "--postprocessor-args", f"VideoRemuxer+ffmpeg_o:{metadata_args}",
+            "-P", temp_dir,
+            "-o", f"{TEMP_VIDEO_NAME}.%(ext)s",
             metadata.url,
         ], check=False) # check=True with exit when any stderr is encountered
     except subprocess.CalledProcessError as e:
@@ -167,162 +403,592 @@ def download_with_yt_dlp_cli(
         sys.exit(1)
 
 
-def download_video(file_path: Path, metadata: Metadata, config: Config) -> None:
-    """Downloads a video with the appropriate method given the
-    link type and user config.
+def journal_partial_download(url: str, temp_dir: Path) -> None:
+    """Keeps an interrupted download's temp directory for the next
+    attempt to resume from, or removes it if nothing was downloaded.
     """
-    link_type = get_link_type(metadata.url)
-    is_mediasite = link_type == LinkType.MEDIASITE
-    if is_mediasite and config.features.custom_mediasite_handler:
-        download_mediasite_video(file_path, metadata)
+    bytes_done = get_dir_size(temp_dir)
+    if bytes_done == 0:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        delete_partial_download(url)
     else:
-        temp_path = get_temp_path(file_path)
-        try:
-            if config.download.use_yt_dlp_cli:
-                download_with_yt_dlp_cli(metadata, temp_path, config)
-            else:
-                download_with_yt_dlp_lib(metadata, temp_path)
-            if not temp_path.is_file():
-                send_notif(
-                    "Error", f"Error downloading video: {metadata.url}"
-                )
-                sys.exit(1)
+        save_partial_download(url, temp_dir, bytes_done=bytes_done)
+
+
+def writes_directly(url: str, config: "Config") -> bool:
+    """Whether `fetch_video` writes straight to the final file path."""
+    is_mediasite = get_link_type(url) == LinkType.MEDIASITE
+    return is_mediasite and config.features.custom_mediasite_handler
+
+
+def fetch_video(
+    file_path: Path,
+    metadata: Metadata,
+    config: "Config",
+    cancel_event: Optional[threading.Event] = None,
+    concurrent_downloads: int = 1,
+) -> Optional[Path]:
+    """Downloads a video with the appropriate method given the link
+    type and user config. Returns the temp directory to hand to
+    `post_process_video`, or None if the video was written straight to
+    `file_path`.
+
+    If the download is interrupted or fails, its temp directory is kept
+    and journaled so the next attempt resumes where this one stopped.
+    Downloads share the bandwidth budget set in `config.download`;
+    yt-dlp CLI downloads each get 1/`concurrent_downloads` of it.
+    """
+    configure_bandwidth(config.download)
+    if writes_directly(metadata.url, config):
+        download_mediasite_video(
+            file_path, metadata, config.features.mediasite_all_streams
+        )
+        return None
+
+    temp_dir = get_temp_dir(file_path, metadata.url)
+    format_spec = None
+    partial = get_partial_download(metadata.url)
+    if partial is not None and Path(partial.temp_path).is_dir():
+        print(f"Resuming download: {metadata.title} "
+              f"({partial.bytes_done} bytes done)")
+        temp_dir = Path(partial.temp_path)
+        if partial.format_id is not None:
+            format_spec = f"{partial.format_id}/{DEFAULT_FORMAT}"
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    save_partial_download(metadata.url, temp_dir)
+    temp_path = temp_dir / f"{TEMP_VIDEO_NAME}.mkv"
+    try:
+        if config.download.use_yt_dlp_cli:
+            download_with_yt_dlp_cli(
+                metadata, temp_dir, config, format_spec, concurrent_downloads
+            )
+        else:
+            download_with_yt_dlp_lib(
+                metadata, temp_dir, format_spec, cancel_event
+            )
+        if not temp_path.is_file():
+            send_notif(
+                "Error", f"Error downloading video: {metadata.url}"
+            )
+            sys.exit(1)
+    except BaseException:
+        journal_partial_download(metadata.url, temp_dir)
+        raise
+    return temp_dir
+
+
+def post_process_video(
+    temp_dir: Path,
+    file_path: Path,
+    metadata: Metadata,
+    config: "Config",
+) -> Optional[str]:
+    """Moves a fetched video into place at `file_path` and returns the
+    yt-dlp format ID it was downloaded in, if known.
+
+    Tags are written by yt-dlp's own merge/remux step, so the finished
+    file is just renamed into place. A second ffmpeg pass only runs
+    when re-encoding or when the download produced no tags.
+    """
+    link_type = get_link_type(metadata.url)
+    temp_path = temp_dir / f"{TEMP_VIDEO_NAME}.mkv"
+    try:
+        if needs_reencode(link_type, config) \
+                or not has_props(temp_path, metadata):
             set_props(temp_path, file_path, metadata, link_type, config)
-        except KeyboardInterrupt as err:
-            temp_path.unlink(missing_ok=True)
-            raise err
-        temp_path.unlink()
+            delete_library_file(temp_path)
+        else:
+            temp_path.replace(file_path)
+            # Keep what has_props parsed for the file's final path
+            move_library_file(temp_path, file_path)
+    except BaseException:
+        journal_partial_download(metadata.url, temp_dir)
+        raise
+    partial = get_partial_download(metadata.url)
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    delete_partial_download(metadata.url)
+    return None if partial is None else partial.format_id
+
+
+def timed_get_metadata(
+    job_id: str,
+    url: str,
+    config: "Config",
+    newsboat_metadata: Optional[Metadata] = None,
+    skip_newsboat: bool = False,
+) -> tuple[Path, Metadata]:
+    """`get_metadata`, recorded as the job's resolve span."""
+    with record_span(job_id, url, "resolve",
+                     profile=config.download.profile_jobs) as span:
+        file_path, metadata = get_metadata(
+            url, config, newsboat_metadata, skip_newsboat
+        )
+        span.artist = metadata.artist
+    return file_path, metadata
+
+
+def timed_fetch_video(
+    job_id: str,
+    file_path: Path,
+    metadata: Metadata,
+    config: "Config",
+    cancel_event: Optional[threading.Event] = None,
+    concurrent_downloads: int = 1,
+) -> Optional[Path]:
+    """`fetch_video`, recorded as the job's fetch span along with the
+    bytes downloaded (not counting any resumed from).
+    """
+    partial = get_partial_download(metadata.url)
+    resumed_bytes = 0
+    if partial is not None and Path(partial.temp_path).is_dir():
+        resumed_bytes = partial.bytes_done
+    with record_span(job_id, metadata.url, "fetch", metadata.artist,
+                     config.download.profile_jobs) as span:
+        temp_dir = fetch_video(
+            file_path, metadata, config, cancel_event, concurrent_downloads
+        )
+        if temp_dir is None:
+            size = file_path.stat().st_size
+        else:
+            size = get_dir_size(temp_dir)
+        span.bytes = max(0, size - resumed_bytes)
+    return temp_dir
 
 
-def handle_single_download(url: str, config: Config) -> None:
+def timed_post_process_video(
+    job_id: str,
+    temp_dir: Path,
+    file_path: Path,
+    metadata: Metadata,
+    config: "Config",
+) -> Optional[str]:
+    """`post_process_video`, recorded as the job's post-process span
+    along with the size of the finished file.
+    """
+    with record_span(job_id, metadata.url, "post-process", metadata.artist,
+                     config.download.profile_jobs) as span:
+        format_id = post_process_video(temp_dir, file_path, metadata, config)
+        span.bytes = file_path.stat().st_size
+    return format_id
+
+
+def register_video(
+    job_id: str,
+    file_path: Path,
+    metadata: Metadata,
+    format_id: Optional[str],
+    config: "Config",
+) -> None:
+    """Records a finished download and releases its reservation, timed
+    as the job's register span.
+    """
+    with record_span(job_id, metadata.url, "register", metadata.artist,
+                     config.download.profile_jobs):
+        details = get_video_details(file_path, format_id)
+        with transaction():
+            insert_video(file_path, metadata, details)
+            clear_reservation(metadata.url)
+
+
+def notify_if_downloaded(url: str) -> bool:
     file_path, metadata = get_video(url)
-    if file_path is not None:
-        assert metadata is not None
-        send_notif("Already Downloaded", metadata.title)
+    if file_path is None:
+        return False
+    assert metadata is not None
+    send_notif("Already Downloaded", metadata.title)
+    return True
+
+
+def get_existing_download(url: str, metadata: Metadata) -> Optional[Metadata]:
+    """Returns the entry that resolving `url` showed to be downloaded
+    already under another URL, recording `url` as an alias of it.
+    """
+    if metadata.canonical_id is None:
+        return None
+    file_path, existing = get_video(url, metadata.canonical_id)
+    if file_path is None:
+        return None
+    add_url_alias(url, metadata.canonical_id)
+    return existing
+
+
+def handle_single_download(
+    url: str,
+    config: "Config",
+    cancel_event: Optional[threading.Event] = None,
+    concurrent_downloads: int = 1,
+) -> None:
+    """Downloads one video. Callers running several at once (the daemon)
+    pass how many, to split the yt-dlp CLI's rate limit between them.
+    """
+    if notify_if_downloaded(url):
         return
+    cleanup_partial_downloads(config)
 
     existing = get_download_in_progress(url)
     if existing is not None:
         send_notif("Download Already In-Progress", existing.title)
         return
 
-    file_path, metadata = get_metadata(url, config)
+    job_id = new_job_id()
+    file_path, metadata = timed_get_metadata(job_id, url, config)
+    existing = get_existing_download(url, metadata)
+    if existing is not None:
+        send_notif("Already Downloaded", existing.title)
+        return
     file_path.parent.mkdir(parents=True, exist_ok=True)
 
     if not try_reserve_url(metadata):
         send_notif("Download Already In-Progress", metadata.title)
         return
 
+    from yt_dlp.utils import DownloadCancelled
+
     send_notif("Starting Download", metadata.title)
+    stage = "fetch"
     try:
-        download_video(file_path, metadata, config)
-    except KeyboardInterrupt:
+        temp_dir = timed_fetch_video(
+            job_id, file_path, metadata, config, cancel_event,
+            concurrent_downloads,
+        )
+        format_id = None
+        if temp_dir is not None:
+            stage = "post-process"
+            format_id = timed_post_process_video(
+                job_id, temp_dir, file_path, metadata, config
+            )
+    except (KeyboardInterrupt, DownloadCancelled):
+        clear_reservation(url)
         send_notif("Canceled Download", metadata.title)
-        file_path.unlink(missing_ok=True)
+        # Another video with the same title may already be at file_path
+        if stage == "post-process" or writes_directly(url, config):
+            file_path.unlink(missing_ok=True)
         sys.exit(1)
+    except BaseException:
+        clear_reservation(url)
+        raise
 
-    insert_video(file_path, metadata)
-    clear_reservation(url)
+    register_video(job_id, file_path, metadata, format_id, config)
     send_notif("Finished Download", metadata.title)
 
 
+def finish_bulk_job(
+    job: BulkJob,
+    stage: str,
+    future: Future[Any],
+    summary: BulkSummary,
+    config: "Config",
+) -> None:
+    """Registers or cleans up a bulk download job that left the pipeline
+    and records its outcome in `summary`. Jobs aborted by a batch
+    cancellation are left to count as remaining.
+
+    The file at `job.file_path` is only removed if this job may have
+    written it: another video with the same title can already be there.
+    A post-process that was canceled before it ran wrote nothing.
+    """
+    from yt_dlp.utils import DownloadCancelled
+
+    assert job.file_path is not None and job.metadata is not None
+    err = DownloadCancelled() if future.cancelled() else future.exception()
+    if err is None:
+        register_video(job.job_id, job.file_path, job.metadata,
+                       job.format_id, config)
+    else:
+        clear_reservation(job.url)
+    if err is None:
+        print(f"\nFinished: {job.metadata.title}")
+        summary.downloaded += 1
+        return
+    ran = not future.cancelled()
+    if ran and (stage == "post-process" or writes_directly(job.url, config)):
+        job.file_path.unlink(missing_ok=True)
+    if not summary.canceled:
+        if not isinstance(err, SystemExit):
+            send_notif(
+                "Error",
+                f"Error downloading video: {job.metadata.title} {err}",
+            )
+        summary.failed += 1
+        summary.failed_urls.append(job.url)
+
+
+def start_adaptive_concurrency(
+    scheduler: DownloadScheduler[Any], config: "Config"
+) -> Optional[AdaptiveConcurrency]:
+    """Starts tuning the scheduler's concurrency from a single download
+    if enabled. Throughput is only measured for in-process downloads,
+    so it stays at the configured maximum with the yt-dlp CLI.
+    """
+    download_config = config.download
+    if not download_config.adaptive_concurrency \
+            or download_config.use_yt_dlp_cli:
+        return None
+    configure_bandwidth(download_config)
+    scheduler.set_concurrency(1)
+    controller = AdaptiveConcurrency(
+        scheduler, get_transferred_bytes, get_rate_limit
+    )
+    controller.start()
+    return controller
+
+
+def run_bulk_download(
+    entries: list[tuple[str, str]],
+    config: "Config",
+    newsboat_metadata: Optional[dict[str, Metadata]] = None,
+) -> BulkSummary:
+    """Downloads every `(url, label)` entry through a pipeline of stages,
+    each with its own worker pool and bounded queue:
+
+    - resolve: looks up metadata and reserves the URL. If given,
+      `newsboat_metadata` holds every entry's Newsboat item that
+      exists, so entries missing from it go straight to yt-dlp
+    - fetch: downloads, bounded by the global and per link type limits
+    - post-process: tags, re-encodes and moves files into place
+    - register: records finished videos in the database
+
+    Fetching one video overlaps with post-processing the previous one.
+    Reservations and database writes are handled on the calling thread,
+    which also moves jobs between stages. Per-stage backpressure is
+    reported at the end.
+
+    On Ctrl-C the whole batch is canceled: queued jobs are dropped,
+    running downloads are aborted and their partial files kept for the
+    next attempt.
+    """
+    cleanup_partial_downloads(config)
+    # Entries were already looked up in Newsboat as a batch
+    skip_newsboat = newsboat_metadata is not None
+    newsboat_metadata = newsboat_metadata or {}
+    download_config = config.download
+    link_type_limits = {
+        link_type: download_config.get_link_type_limit(link_type)
+        for link_type in LinkType
+    }
+    # Every stage reports finished jobs here, tagged with its name
+    events: queue.Queue[tuple[tuple[str, BulkJob], Future[Any]]] = \
+        queue.Queue()
+
+    def report_to(stage: str, job: BulkJob) -> Callable[[Future[Any]], None]:
+        return lambda future: events.put(((stage, job), future))
+
+    resolver = ThreadPoolExecutor(
+        max_workers=download_config.max_concurrent_resolves
+    )
+    scheduler = DownloadScheduler[tuple[str, BulkJob]](
+        download_config.max_concurrent_downloads, link_type_limits, events
+    )
+    post_processor = ThreadPoolExecutor(
+        max_workers=download_config.max_concurrent_postprocess
+    )
+
+    def start_resolve(job: BulkJob) -> None:
+        resolver.submit(
+            timed_get_metadata,
+            job.job_id,
+            job.url,
+            config,
+            newsboat_metadata.get(job.url),
+            skip_newsboat,
+        ).add_done_callback(report_to("resolve", job))
+
+    def start_fetch(job: BulkJob) -> None:
+        scheduler.submit(
+            ("fetch", job),
+            get_link_type(job.url),
+            timed_fetch_video,
+            job.job_id,
+            job.file_path,
+            job.metadata,
+            config,
+            scheduler.cancel_event,
+            download_config.max_concurrent_downloads,
+        )
+
+    def run_post_process(job: BulkJob) -> None:
+        assert job.temp_dir is not None
+        assert job.file_path is not None and job.metadata is not None
+        job.format_id = timed_post_process_video(
+            job.job_id, job.temp_dir, job.file_path, job.metadata, config
+        )
+
+    def start_post_process(job: BulkJob) -> None:
+        post_processor.submit(run_post_process, job).add_done_callback(
+            report_to("post-process", job)
+        )
+
+    queue_size = download_config.stage_queue_size
+    resolve = Stage("resolve", download_config.max_concurrent_resolves,
+                    queue_size, start_resolve)
+    fetch = Stage("fetch", download_config.max_concurrent_downloads,
+                  queue_size, start_fetch)
+    post_process = Stage("post-process",
+                         download_config.max_concurrent_postprocess,
+                         queue_size, start_post_process)
+
+    summary = BulkSummary(total=len(entries))
+    # Jobs holding a reservation that haven't been finished yet
+    reserved: dict[str, BulkJob] = {}
+    unfinished = len(entries)
+    for i, (url, label) in enumerate(entries):
+        resolve.put(BulkJob(i, url, label, new_job_id()))
+    controller = start_adaptive_concurrency(scheduler, config)
+    with scheduler, post_processor:
+        try:
+            while unfinished:
+                (stage, job), future = events.get()
+                if stage == "resolve":
+                    resolve.done()
+                    err = future.exception()
+                    if err is not None:
+                        if not isinstance(err, SystemExit):
+                            send_notif(
+                                "Error",
+                                f"Error locating video: {job.url} {err}",
+                            )
+                        summary.failed += 1
+                        summary.failed_urls.append(job.url)
+                        unfinished -= 1
+                        continue
+                    job.file_path, job.metadata = future.result()
+                    progress = f"({job.index + 1}/{len(entries)})"
+                    existing = get_existing_download(job.url, job.metadata)
+                    if existing is not None:
+                        print(f"\nAlready downloaded: {job.label} {progress}")
+                        summary.skipped += 1
+                        unfinished -= 1
+                        continue
+                    job.file_path.parent.mkdir(parents=True, exist_ok=True)
+                    if not try_reserve_url(job.metadata):
+                        print(f"\nSkipping: {job.label} {progress}")
+                        summary.skipped += 1
+                        unfinished -= 1
+                        continue
+                    print(f"\nQueued: {job.label} {progress}")
+                    reserved[job.url] = job
+                    fetch.put(job)
+                    continue
+                if stage == "fetch":
+                    fetch.done()
+                    if future.exception() is None:
+                        job.temp_dir = future.result()
+                        if job.temp_dir is not None:
+                            post_process.put(job)
+                            continue
+                else:
+                    post_process.done()
+                finish_bulk_job(job, stage, future, summary, config)
+                del reserved[job.url]
+                unfinished -= 1
+        except KeyboardInterrupt:
+            summary.canceled = True
+            # In-flight extractions cannot be interrupted, so don't wait
+            resolver.shutdown(wait=False, cancel_futures=True)
+            scheduler.cancel()
+            post_processor.shutdown(wait=True, cancel_futures=True)
+            # Register what completed and clean up what failed. Fetched
+            # videos that weren't post-processed, including those whose
+            # post-process was canceled before it ran, stay journaled.
+            while not events.empty():
+                (stage, job), future = events.get()
+                if job.url not in reserved:
+                    continue
+                if stage == "post-process" and future.cancelled():
+                    continue
+                fetched = stage == "fetch" and not future.cancelled() \
+                    and future.exception() is None
+                if fetched and future.result() is not None:
+                    continue
+                finish_bulk_job(job, stage, future, summary, config)
+                del reserved[job.url]
+            with transaction():
+                for url in reserved:
+                    clear_reservation(url)
+        finally:
+            resolver.shutdown(wait=False, cancel_futures=True)
+            if controller is not None:
+                controller.stop()
+    print_stage_report([resolve, fetch, post_process])
+    return summary
+
+
 def handle_bulk_feed_download(
     feed_url: str,
-    config: Config,
+    config: "Config",
     only_unread: bool,
 ) -> None:
-    feed, all_items = fetch_newsboat_feed_and_items(feed_url)
+    feed = fetch_newsboat_feed(feed_url)
     if feed is None:
         send_notif("Error", f"Could not find feed: {feed_url}")
         sys.exit(1)
 
+    # Stream only the columns we need and check them against the
+    # library one batch at a time
+    considered = 0
     items = []
-    for item in all_items:
-        file_path, _ = get_video(item.url)
-        if file_path is not None:
-            continue
-        if item.unread or not only_unread:
-            items.append(item)
+    records = iter_newsboat_feed_items(
+        feed, ("url", "title"), only_unread=only_unread
+    )
+    for batch in itertools.batched(records, 1000):
+        considered += len(batch)
+        downloaded = get_downloaded_urls(item.url for item in batch)
+        items.extend(item for item in batch if item.url not in downloaded)
 
     if len(items) == 0:
-        send_notif("All Downloaded", f"{feed.title} ({len(all_items)} videos)")
+        send_notif("All Downloaded", f"{feed.title} ({considered} videos)")
         sys.exit(1)
 
     send_notif("Starting Bulk Download", f"{feed.title} ({len(items)} videos)")
-    skipped = 0
-    for i, item in enumerate(items):
-        file_path, metadata = get_metadata(item.url, config)
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        if not try_reserve_url(metadata):
-            print(f"\nSkipping: {item.title} ({i+1}/{len(items)})")
-            skipped += 1
-            continue
-        print(f"\nDownloading: {item.title} ({i+1}/{len(items)})\n")
-        try:
-            download_video(file_path, metadata, config)
-        except KeyboardInterrupt:
-            rem = len(items) - i
-            send_notif(
-                "Canceled Bulk Download",
-                f"{feed.title} {rem}/{len(items)} remaining",
-            )
-            file_path.unlink(missing_ok=True)
-            sys.exit(1)
-        insert_video(file_path, metadata)
-        clear_reservation(metadata.url)
-
-    downloaded = len(items) - skipped
-    if skipped == 0:
-        msg = f"{feed.title} ({downloaded} downloaded)"
-    else:
-        msg = f"{feed.title} ({downloaded} downloaded, {skipped} skipped)"
-    send_notif("Finished Bulk Download", msg)
+    summary = run_bulk_download(
+        [(item.url, item.title) for item in items],
+        config,
+        {item.url: Metadata(url=item.url, title=item.title, artist=feed.title)
+         for item in items},
+    )
+    if summary.canceled:
+        send_notif(
+            "Canceled Bulk Download",
+            f"{feed.title} {summary.remaining}/{summary.total} remaining",
+        )
+        sys.exit(1)
+    send_notif("Finished Bulk Download", f"{feed.title} ({summary.describe()})")
 
 
-def handle_bulk_file_download(list_path: Path, config: Config) -> None:
+def handle_bulk_file_download(list_path: Path, config: "Config") -> None:
     all_urls = read_urls_from_file(list_path)
     if all_urls is None:
         sys.exit(1)
 
-    urls = []
-    for url in all_urls:
-        file_path, _ = get_video(url)
-        if file_path is None:
-            urls.append(url)
+    downloaded = get_downloaded_urls(all_urls)
+    urls = [url for url in all_urls if url not in downloaded]
 
     if len(urls) == 0:
         send_notif("All Downloaded", f"{list_path} ({len(urls)} videos)")
         sys.exit(1)
 
     send_notif("Starting Bulk Download", f"{list_path} ({len(urls)} videos)")
-    skipped = 0
-    for i, url in enumerate(urls):
-        file_path, metadata = get_metadata(url, config)
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        if not try_reserve_url(metadata):
-            print(f"\nSkipping: {url} ({i+1}/{len(urls)})")
-            skipped += 1
-            continue
-        print(f"\nDownloading: {url} ({i+1}/{len(urls)})\n")
-        try:
-            download_video(file_path, metadata, config)
-        except KeyboardInterrupt:
-            rem = len(urls) - i
-            send_notif("Canceled Bulk Download", f"{rem}/{len(urls)} remaining")
-            file_path.unlink(missing_ok=True)
-            sys.exit(1)
-        insert_video(file_path, metadata)
-        clear_reservation(metadata.url)
-
-    downloaded = len(urls) - skipped
-    if skipped == 0:
-        msg = f"{list_path} ({downloaded} downloaded)"
-    else:
-        msg = f"{list_path} ({downloaded} downloaded, {skipped} skipped)"
-    send_notif("Finished Bulk Download", msg)
+    newsboat_items = fetch_newsboat_items(urls)
+    summary = run_bulk_download(
+        [(url, url) for url in urls],
+        config,
+        {url: newsboat_to_video_metadata(item)
+         for url, item in newsboat_items.items()},
+    )
+    if summary.canceled:
+        send_notif(
+            "Canceled Bulk Download",
+            f"{summary.remaining}/{summary.total} remaining",
+        )
+        sys.exit(1)
+    send_notif("Finished Bulk Download", f"{list_path} ({summary.describe()})")
 
 
 def main() -> None:
+    if len(sys.argv) == 2 and notify_if_downloaded(sys.argv[1]):
+        return
+
+    from config import load_config
     config = load_config(CONFIG_PATH)
     if config is None:
         sys.exit(1)
@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import subprocess
+import tempfile
+
+
+# Chunks shorter than this aren't worth an extra ffmpeg process
+MIN_CHUNK_SECONDS = 10.0
+# Chunks per worker, so workers that finish early pick up the slack
+CHUNKS_PER_WORKER = 2
+
+
+def get_duration(in_path: Path) -> float:
+    result = subprocess.run([
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        str(in_path),
+    ], check=True, capture_output=True, text=True)
+    return float(result.stdout.strip())
+
+
+def split_at_keyframes(
+    in_path: Path, chunk_dir: Path, chunk_seconds: float
+) -> list[Path]:
+    """Splits the first video stream into chunks of roughly
+    `chunk_seconds`, cutting only at keyframes so no frames are lost.
+    """
+    subprocess.run([
+        "ffmpeg",
+        "-y",
+        "-loglevel", "error",
+        "-i", str(in_path),
+        "-map", "0:v:0",
+        "-codec", "copy",
+        "-f", "segment",
+        "-segment_time", f"{chunk_seconds:.3f}",
+        "-reset_timestamps", "1",
+        str(chunk_dir / "chunk%05d.mkv"),
+    ], check=True)
+    return sorted(chunk_dir.glob("chunk*.mkv"))
+
+
+def encode_chunk(
+    chunk_path: Path, out_path: Path, preset: str, crf: int, threads: int
+) -> None:
+    subprocess.run([
+        "ffmpeg",
+        "-y",
+        "-loglevel", "error",
+        "-i", str(chunk_path),
+        "-codec:v", "libx264",
+        "-preset", preset,
+        "-crf", str(crf),
+        "-threads", str(threads),
+        str(out_path),
+    ], check=True)
+
+
+def concat_chunks(
+    chunk_paths: list[Path],
+    audio_source: Path,
+    out_path: Path,
+    output_args: list[str],
+) -> None:
+    """Joins the encoded chunks without re-encoding and copies the
+    audio (and any subtitles) from `audio_source`.
+    """
+    list_path = chunk_paths[0].with_name("chunks.txt")
+    list_path.write_text(
+        "".join(f"file '{path.name}'\n" for path in chunk_paths)
+    )
+    subprocess.run([
+        "ffmpeg",
+        "-y",  # overwrite destination file without asking
+        "-loglevel", "error",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", str(list_path),
+        "-i", str(audio_source),
+        "-map", "0:v",
+        "-map", "1:a?",
+        "-map", "1:s?",
+        *output_args,
+        "-codec", "copy",
+        str(out_path),
+    ], check=True)
+
+
+def encode_chunked(
+    in_path: Path,
+    out_path: Path,
+    output_args: list[str],
+    preset: str,
+    crf: int,
+    cores: int = 0,
+) -> None:
+    """Re-encodes the video of `in_path` to H.264 across up to `cores`
+    ffmpeg processes (0 means every core), copying the audio as is.
+
+    The video is split at keyframes, the chunks are encoded in
+    parallel, and the results are concatenated into `out_path` with
+    `output_args` (e.g. metadata tags) applied.
+    """
+    cores = cores or os.cpu_count() or 1
+    duration = get_duration(in_path)
+    chunk_count = max(1, min(cores * CHUNKS_PER_WORKER,
+                             int(duration // MIN_CHUNK_SECONDS)))
+    with tempfile.TemporaryDirectory(
+        prefix=f".{out_path.name}.", dir=out_path.parent
+    ) as tmp:
+        chunk_dir = Path(tmp)
+        chunks = split_at_keyframes(in_path, chunk_dir,
+                                    duration / chunk_count)
+        workers = min(cores, len(chunks))
+        threads = max(1, cores // workers)
+        encoded = [chunk.with_name(f"enc-{chunk.name}") for chunk in chunks]
+        print(f"Encoding {len(chunks)} chunks on {workers} workers")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(encode_chunk, chunk, out, preset, crf, threads)
+                for chunk, out in zip(chunks, encoded)
+            ]
+            for future in futures:
+                future.result()
+        concat_chunks(encoded, in_path, out_path, output_args)
@@ -0,0 +1,257 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+import re
+import subprocess
+import sys
+import time
+from typing import IO, TYPE_CHECKING, Optional
+from urllib.parse import urljoin
+
+from bandwidth import throttle
+
+if TYPE_CHECKING:
+    import requests
+
+
+# Segments fetched at once; per-connection throttling makes more help
+HLS_WORKERS = 8
+# Attempts per segment before the download is abandoned
+HLS_SEGMENT_ATTEMPTS = 4
+HLS_RETRY_BACKOFF = 1.0
+HLS_TIMEOUT = 30.0
+
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+class HlsError(Exception):
+    pass
+
+
+class HlsUnsupportedError(HlsError):
+    """The playlist uses a feature (e.g. encryption) that only ffmpeg's
+    own HLS demuxer handles.
+    """
+
+
+@dataclass
+class Segment:
+    url: str
+    # (length, offset) from EXT-X-BYTERANGE / BYTERANGE
+    byte_range: Optional[tuple[int, int]] = None
+
+
+@dataclass
+class MediaPlaylist:
+    segments: list[Segment]
+    init_segment: Optional[Segment] = None
+
+
+def parse_attributes(attrs: str) -> dict[str, str]:
+    return {key: value.strip('"')
+            for key, value in ATTRIBUTE_PATTERN.findall(attrs)}
+
+
+def parse_byte_range(spec: str, next_offset: int) -> tuple[int, int]:
+    length, _, offset = spec.partition("@")
+    return int(length), int(offset) if offset else next_offset
+
+
+def parse_master_playlist(text: str, base_url: str) -> Optional[str]:
+    """Returns the URL of the highest bandwidth variant, or None if
+    `text` is a media playlist.
+    """
+    best: Optional[tuple[int, str]] = None
+    has_audio_renditions = False
+    lines = iter(text.splitlines())
+    for line in lines:
+        if line.startswith("#EXT-X-MEDIA:"):
+            attrs = parse_attributes(line.partition(":")[2])
+            if attrs.get("TYPE") == "AUDIO" and "URI" in attrs:
+                has_audio_renditions = True
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            attrs = parse_attributes(line.partition(":")[2])
+            uri = next(lines, "").strip()
+            bandwidth = int(attrs.get("BANDWIDTH", 0))
+            if best is None or bandwidth > best[0]:
+                best = (bandwidth, urljoin(base_url, uri))
+    if best is not None and has_audio_renditions:
+        raise HlsUnsupportedError("separate audio renditions")
+    return None if best is None else best[1]
+
+
+def parse_media_playlist(text: str, base_url: str) -> MediaPlaylist:
+    segments = []
+    init_segment = None
+    byte_range = None
+    next_offset = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-KEY:"):
+            attrs = parse_attributes(line.partition(":")[2])
+            if attrs.get("METHOD", "NONE") != "NONE":
+                raise HlsUnsupportedError(f"{attrs['METHOD']} encryption")
+        elif line.startswith("#EXT-X-MAP:"):
+            attrs = parse_attributes(line.partition(":")[2])
+            init_segment = Segment(urljoin(base_url, attrs["URI"]))
+            if "BYTERANGE" in attrs:
+                init_segment.byte_range = parse_byte_range(
+                    attrs["BYTERANGE"], 0
+                )
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            byte_range = parse_byte_range(line.partition(":")[2], next_offset)
+            next_offset = sum(byte_range)
+        elif not line.startswith("#"):
+            segments.append(Segment(urljoin(base_url, line), byte_range))
+            byte_range = None
+    if not segments:
+        raise HlsError("playlist has no segments")
+    return MediaPlaylist(segments, init_segment)
+
+
+def fetch_text(
+    session: "requests.Session", url: str, headers: dict[str, str]
+) -> str:
+    import requests
+
+    try:
+        response = session.get(url, headers=headers, timeout=HLS_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        raise HlsError(f"failed to fetch {url}: {e}") from e
+    return response.text
+
+
+def fetch_playlist(
+    session: "requests.Session", url: str, headers: dict[str, str]
+) -> MediaPlaylist:
+    text = fetch_text(session, url, headers)
+    variant_url = parse_master_playlist(text, url)
+    if variant_url is not None:
+        url = variant_url
+        text = fetch_text(session, url, headers)
+    return parse_media_playlist(text, url)
+
+
+def fetch_segment(
+    session: "requests.Session", segment: Segment, headers: dict[str, str]
+) -> bytes:
+    """Downloads one segment, retrying with exponential backoff."""
+    import requests
+
+    if segment.byte_range is not None:
+        length, offset = segment.byte_range
+        headers = {**headers, "Range": f"bytes={offset}-{offset + length - 1}"}
+    attempt = 0
+    while True:
+        try:
+            response = session.get(
+                segment.url, headers=headers, timeout=HLS_TIMEOUT
+            )
+            response.raise_for_status()
+            throttle(len(response.content))
+            return response.content
+        except requests.RequestException as e:
+            attempt += 1
+            if attempt == HLS_SEGMENT_ATTEMPTS:
+                raise HlsError(f"failed to fetch {segment.url}: {e}") from e
+            time.sleep(HLS_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+
+def write_segments(
+    out: IO[bytes],
+    session: "requests.Session",
+    playlist: MediaPlaylist,
+    headers: dict[str, str],
+    workers: int,
+) -> None:
+    """Fetches segments concurrently and writes them to `out` in order.
+    At most `2 * workers` segments are held in memory at once.
+    """
+    if playlist.init_segment is not None:
+        out.write(fetch_segment(session, playlist.init_segment, headers))
+    segments = iter(playlist.segments)
+    total = len(playlist.segments)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending: deque[Future[bytes]] = deque()
+
+        def submit_next() -> None:
+            segment = next(segments, None)
+            if segment is not None:
+                pending.append(
+                    pool.submit(fetch_segment, session, segment, headers)
+                )
+
+        for _ in range(2 * workers):
+            submit_next()
+        done = 0
+        try:
+            while pending:
+                data = pending.popleft().result()
+                submit_next()
+                out.write(data)
+                done += 1
+                print(f"\rSegments: {done}/{total}", end="", flush=True)
+        finally:
+            for future in pending:
+                future.cancel()
+            print()
+
+
+def download_hls(
+    m3u8_url: str,
+    out_path: Path,
+    output_args: list[str],
+    session: "requests.Session",
+    headers: Optional[dict[str, str]] = None,
+    workers: int = HLS_WORKERS,
+) -> None:
+    """Downloads an HLS stream with `workers` parallel segment fetches
+    and remuxes it into `out_path` with ffmpeg (`-c copy` plus
+    `output_args`, e.g. metadata tags).
+
+    Raises HlsUnsupportedError for playlists that need ffmpeg's own
+    HLS demuxer and HlsError for any other failure.
+    """
+    headers = headers or {}
+    playlist = fetch_playlist(session, m3u8_url, headers)
+    ffmpeg = subprocess.Popen([
+        "ffmpeg",
+        "-y",  # overwrite destination file without asking
+        "-loglevel", "error",
+        "-i", "pipe:0",
+        *output_args,
+        "-c", "copy",
+        str(out_path),
+    ], stdin=subprocess.PIPE)
+    assert ffmpeg.stdin is not None
+    try:
+        write_segments(ffmpeg.stdin, session, playlist, headers, workers)
+        ffmpeg.stdin.close()
+    except BrokenPipeError:
+        pass  # ffmpeg exited early; its return code says why
+    except BaseException:
+        ffmpeg.kill()
+        ffmpeg.wait()
+        out_path.unlink(missing_ok=True)
+        raise
+    if ffmpeg.wait() != 0:
+        out_path.unlink(missing_ok=True)
+        raise HlsError(f"ffmpeg exited with status {ffmpeg.returncode}")
+
+
+def main() -> None:
+    import requests
+
+    if len(sys.argv) != 3:
+        print("Invalid number of arguments.", file=sys.stderr)
+        print("\tFormat: <M3U8 URL> <OUTPUT>", file=sys.stderr)
+        sys.exit(1)
+    download_hls(sys.argv[1], Path(sys.argv[2]), [], requests.Session())
+
+
+if __name__ == "__main__":
+    main()
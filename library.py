@@ -0,0 +1,204 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+import os
+from pathlib import Path
+from typing import Iterator, Optional
+
+from constants import VIDEOS_DIR
+from database import (
+    delete_video,
+    get_all_videos,
+    get_library_file,
+    get_library_files,
+    get_videos_missing_details,
+    insert_video,
+    save_library_file,
+    sync_library_files,
+    transaction,
+    update_video_details,
+    update_video_path,
+)
+from models import LibraryFile, Metadata, RescanSummary, VideoDetails
+from util import read_media, remove_dir_if_empty
+
+
+# MediaInfo parses run on this many threads; the parser is a C library
+# called through ctypes, which releases the GIL
+SCAN_WORKERS = 8
+
+type Identity = tuple[int, int, int]
+
+
+def iter_video_files(root: Path) -> Iterator[tuple[Path, os.stat_result]]:
+    """Yields every MKV under `root`, skipping hidden files and
+    directories (e.g. the temp directories of running downloads).
+    """
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = [d for d in dir_names if not d.startswith(".")]
+        for name in file_names:
+            if name.endswith(".mkv") and not name.startswith("."):
+                path = Path(dir_path) / name
+                try:
+                    yield path, path.stat()
+                except FileNotFoundError:
+                    continue  # deleted mid-scan
+
+
+def get_identity(st: os.stat_result) -> Identity:
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def parse_video_file(path: Path, st: os.stat_result) -> LibraryFile:
+    tags: Optional[Metadata]
+    details: Optional[VideoDetails]
+    try:
+        tags, details = read_media(path)
+    except OSError:  # MediaInfo library unavailable
+        tags, details = None, None
+    if tags is not None and not tags.url:
+        tags = None
+    if tags is not None:
+        tags = Metadata(
+            url=tags.url,
+            title=tags.title or path.stem,
+            artist=tags.artist or path.parent.name,
+        )
+    return LibraryFile(path, *get_identity(st), tags, details)
+
+
+def read_video_file(path: Path) -> LibraryFile:
+    """Returns a file's tags and details, parsing it only if no file
+    with the same (inode, size, mtime) has been parsed before. Raises
+    OSError if the file can't be read.
+    """
+    st = path.stat()
+    cached = get_library_file(*get_identity(st))
+    if cached is not None and cached.details is not None:
+        return replace(cached, path=path)
+    f = parse_video_file(path, st)
+    save_library_file(f)
+    return f
+
+
+def scan_library(
+    root: Path, workers: int, summary: RescanSummary
+) -> list[LibraryFile]:
+    """Lists the video files under `root` with their tags. Files whose
+    (inode, size, mtime) match the last scan, under their old path or a
+    new one, reuse the cached tags and details; the rest are parsed in
+    parallel.
+    """
+    cached = get_library_files()
+    by_path = {f.path: f for f in cached}
+    by_identity = {(f.inode, f.size, f.mtime_ns): f for f in cached}
+    files = []
+    to_parse = []
+    for path, st in iter_video_files(root):
+        summary.scanned += 1
+        identity = get_identity(st)
+        known = by_path.get(path)
+        if known is None or (known.inode, known.size, known.mtime_ns) \
+                != identity:
+            known = by_identity.get(identity)
+        if known is not None and known.details is not None:
+            files.append(replace(known, path=path))
+        else:
+            to_parse.append((path, st))
+    summary.parsed = len(to_parse)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        files.extend(pool.map(lambda args: parse_video_file(*args), to_parse))
+    return files
+
+
+def get_file_details(f: LibraryFile) -> Optional[VideoDetails]:
+    """Details for a file found on disk rather than downloaded, using
+    its modification time as the download time.
+    """
+    if f.details is None:
+        return None
+    return replace(f.details, size=f.size, downloaded_at=f.mtime_ns / 1e9)
+
+
+def backfill_details(files: list[LibraryFile], summary: RescanSummary) -> None:
+    """Fills in the stream details of entries registered before they
+    were recorded, from the scanned files or (for files outside the
+    library root) by reading them.
+    """
+    by_path = {f.path: f for f in files}
+    for path, url in get_videos_missing_details():
+        f = by_path.get(path)
+        if f is None:
+            try:
+                f = read_video_file(path)
+            except OSError:
+                continue
+        details = get_file_details(f)
+        if details is not None:
+            update_video_details(url, details)
+            summary.backfilled += 1
+
+
+def rescan_library(
+    root: Path = VIDEOS_DIR, workers: int = SCAN_WORKERS
+) -> RescanSummary:
+    """Reconciles the database with the files on disk, in one
+    transaction:
+
+    - entries whose file moved (found by its URL tag) get the new path
+    - tagged files missing from the database are added
+    - entries whose file is gone are removed
+    - entries without stream details get them backfilled
+    - cached files whose path wasn't seen are forgotten
+    """
+    summary = RescanSummary()
+    files = scan_library(root, workers, summary)
+
+    registered = {metadata.url: path for path, metadata in get_all_videos()}
+    found: dict[str, LibraryFile] = {}
+    for f in files:
+        if f.tags is None:
+            continue
+        # Prefer the copy at the registered path if there are several
+        if f.tags.url not in found or registered.get(f.tags.url) == f.path:
+            found[f.tags.url] = f
+
+    url_at_path = {f.path: f.tags.url for f in files if f.tags is not None}
+
+    def is_vacated(url: str, path: Path) -> bool:
+        """The file is gone, or the path now holds another video."""
+        return url_at_path.get(path, url) != url or not path.is_file()
+
+    removed = [url for url, path in registered.items()
+               if url not in found and is_vacated(url, path)]
+    moved = [f for url, f in found.items()
+             if url in registered and registered[url] != f.path
+             and is_vacated(url, registered[url])]
+    added = [f for url, f in found.items() if url not in registered]
+
+    with transaction():
+        for url in removed:
+            print(f"Removing deleted entry: {registered[url]}")
+            delete_video(url)
+        # Park moved entries on a unique placeholder first, so paths can
+        # be swapped between entries without tripping the UNIQUE index
+        for f in moved:
+            assert f.tags is not None
+            update_video_path(f.tags.url, f"\0{f.tags.url}")
+        for f in moved:
+            assert f.tags is not None
+            print(f"Moved: {registered[f.tags.url]} -> {f.path}")
+            update_video_path(f.tags.url, str(f.path))
+        for f in added:
+            assert f.tags is not None
+            print(f"Adding: {f.path}")
+            insert_video(f.path, f.tags, get_file_details(f))
+        backfill_details(files, summary)
+        forgotten = sync_library_files(files)
+
+    for url in removed:
+        remove_dir_if_empty(registered[url].parent)
+    summary.removed = len(removed)
+    summary.moved = len(moved)
+    summary.added = len(added)
+    summary.forgotten = forgotten
+    return summary
@@ -1,22 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
 from pathlib import Path
 import sys
-from typing import Any, Optional
-import browser_cookie3
-import requests
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Optional
 import subprocess
 
-from yt_dlp.utils import sanitize_filename
-
 from constants import VIDEOS_DIR
 from database import get_video, insert_video, Metadata
+from hls import HLS_WORKERS, HlsError, HlsUnsupportedError, download_hls
 from newsboat import get_metadata_from_newsboat
-from util import send_notif
+from util import get_metadata_args, send_notif
 
+if TYPE_CHECKING:
+    import requests
 
-def get_cookie_string(domain_filter: str) -> str:
+
+MEDIASITE_DOMAIN = "mediasite.video.ufl.edu"
+MEDIASITE_STREAM_HEADERS = {
+    "Referer": f"https://{MEDIASITE_DOMAIN}/",
+    "Origin": f"https://{MEDIASITE_DOMAIN}",
+}
+# Overridable so the player service can be replaced by a local stand-in
+# (see benchmarks/e2e.py)
+PLAYER_SERVICE_URL = os.environ.get(
+    "VIDEO_MANAGER_PLAYER_SERVICE",
+    f"https://{MEDIASITE_DOMAIN}/Mediasite/PlayerService/PlayerService.svc",
+)
+# Track titles for Mediasite StreamType values
+STREAM_ROLES = {
+    0: "Presenter",
+    2: "Slides",
+    3: "Screen",
+    4: "Camera 2",
+    5: "Camera 3",
+}
+# Seconds a cookie string read from Firefox is reused before re-reading
+COOKIE_TTL = 15 * 60
+
+_cookie_lock = threading.Lock()
+_cookie_cache: dict[str, tuple[float, str]] = {}
+_session_lock = threading.Lock()
+_session: Optional["requests.Session"] = None
+_session_pool_size = 0
+
+
+def read_cookie_string(domain_filter: str) -> str:
     """Extract cookies for the given domain and return them as a
     Cookie header string.
     """
+    import browser_cookie3
+
     cj = browser_cookie3.firefox()
     cookies = []
     for cookie in cj:
@@ -25,13 +60,51 @@ def get_cookie_string(domain_filter: str) -> str:
     return "; ".join(cookies)
 
 
+def get_cookie_string(domain_filter: str) -> str:
+    """Like `read_cookie_string`, but reuses the result for
+    `COOKIE_TTL` seconds since reading Firefox's cookie database is slow.
+    """
+    with _cookie_lock:
+        cached = _cookie_cache.get(domain_filter)
+        if cached is not None and time.monotonic() - cached[0] < COOKIE_TTL:
+            return cached[1]
+        cookie_string = read_cookie_string(domain_filter)
+        _cookie_cache[domain_filter] = (time.monotonic(), cookie_string)
+        return cookie_string
+
+
+def invalidate_cookie_string(domain_filter: str) -> None:
+    with _cookie_lock:
+        _cookie_cache.pop(domain_filter, None)
+
+
+def get_session(pool_size: int = HLS_WORKERS) -> "requests.Session":
+    """Returns the process-wide session, so player option requests
+    reuse one keep-alive connection. Its connection pool is grown to
+    keep at least `pool_size` connections, e.g. one per segment fetch
+    thread, rather than discarding the overflow.
+    """
+    global _session, _session_pool_size
+    with _session_lock:
+        if _session is None:
+            import requests
+            _session = requests.Session()
+        if pool_size > _session_pool_size:
+            from requests.adapters import HTTPAdapter
+            adapter = HTTPAdapter(pool_maxsize=pool_size)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            _session_pool_size = pool_size
+        return _session
+
+
 def get_player_options(
     cookie_string: str, video_url: str, video_id: str
 ) -> dict[str, Any]:
     """Make the POST request to the GetPlayerOptions endpoint using
     the Cookie header.
     """
-    url = "https://mediasite.video.ufl.edu/Mediasite/PlayerService/PlayerService.svc/json/GetPlayerOptions"
+    url = f"{PLAYER_SERVICE_URL}/json/GetPlayerOptions"
     headers = {
         "Accept": "*/*",
         "Accept-Language": "en-US,en;q=0.5",
@@ -55,83 +128,218 @@ def get_player_options(
             "UrlReferrer": None
         }
     }
-    response = requests.post(url, headers=headers, json=data)
+    response = get_session().post(url, headers=headers, json=data)
     response.raise_for_status()
     return response.json()
 
 
+def has_presentation(json_response: dict[str, Any]) -> bool:
+    """A null Presentation usually means the auth cookies expired."""
+    try:
+        return json_response["d"]["Presentation"] is not None
+    except (KeyError, TypeError):
+        return False
+
+
+def fetch_player_options(video_url: str, video_id: str) -> dict[str, Any]:
+    """Gets the player options with the cached cookies, re-reading them
+    from Firefox once if the server rejects them.
+    """
+    json_data = get_player_options(
+        get_cookie_string(MEDIASITE_DOMAIN), video_url, video_id
+    )
+    if not has_presentation(json_data):
+        invalidate_cookie_string(MEDIASITE_DOMAIN)
+        json_data = get_player_options(
+            get_cookie_string(MEDIASITE_DOMAIN), video_url, video_id
+        )
+    return json_data
+
+
+def get_m3u8_location(stream: dict[str, Any]) -> Optional[str]:
+    m3u8_mimetype = "audio/x-mpegurl"
+    for video_url in stream["VideoUrls"] or []:
+        if video_url.get("MimeType") == m3u8_mimetype:
+            return video_url["Location"]
+    return None
+
+
 def extract_mediasite_m3u8_url(json_response: dict[str, Any]) -> Optional[str]:
     """Extract the first m3u8 URL from the JSON response."""
-    m3u8_mimetype = "audio/x-mpegurl"
     try:
         presentation = json_response["d"]["Presentation"]
         if presentation is None:
             print("Presentation is null in json (extracting m3u8 url)")
             return None  # might be expired auth
-        for video_url in presentation["Streams"][0]["VideoUrls"]:
-            if video_url.get("MimeType") == m3u8_mimetype:
-                return video_url["Location"]
-        return None
+        return get_m3u8_location(presentation["Streams"][0])
     except (KeyError, IndexError, TypeError) as e:
         print(f"Unable to parse json for m3u8 url: {str(e)}")
         return None
 
 
-def download_m3u8(m3u8_url: str, out_path: Path, metadata: Metadata) -> None:
+def extract_mediasite_streams(
+    json_response: dict[str, Any]
+) -> list[tuple[str, str]]:
+    """Extract the role and m3u8 URL of every stream that has one."""
+    try:
+        presentation = json_response["d"]["Presentation"]
+        if presentation is None:
+            print("Presentation is null in json (extracting m3u8 url)")
+            return []  # might be expired auth
+        streams = []
+        for i, stream in enumerate(presentation["Streams"]):
+            location = get_m3u8_location(stream)
+            if location is not None:
+                role = STREAM_ROLES.get(stream.get("StreamType"),
+                                        f"Stream {i + 1}")
+                streams.append((role, location))
+        return streams
+    except (KeyError, TypeError) as e:
+        print(f"Unable to parse json for m3u8 urls: {str(e)}")
+        return []
+
+
+def get_error_message(e: Exception) -> str:
+    if isinstance(e, subprocess.CalledProcessError) and e.stderr is not None:
+        return e.stderr.decode()
+    return str(e)
+
+
+def fetch_m3u8(m3u8_url: str, out_path: Path, output_args: list[str]) -> None:
+    """Download the stream with parallel segment fetches, falling back
+    to FFmpeg's own HLS demuxer for playlists it can't handle.
+    """
+    try:
+        download_hls(
+            m3u8_url,
+            out_path,
+            output_args,
+            get_session(),
+            MEDIASITE_STREAM_HEADERS,
+        )
+        return
+    except HlsUnsupportedError as e:
+        print(f"Falling back to FFmpeg HLS download: {e}")
+    download_m3u8_with_ffmpeg(m3u8_url, out_path, output_args)
+
+
+def download_m3u8_with_ffmpeg(
+    m3u8_url: str, out_path: Path, output_args: list[str]
+) -> None:
     """Call FFmpeg with the m3u8 URL and additional headers."""
+    headers = "".join(
+        f"{key}: {value}\r\n" for key, value in MEDIASITE_STREAM_HEADERS.items()
+    )
+    subprocess.run([
+        "ffmpeg",
+        "-y",  # overwrite destination file without asking
+        "-headers", headers,
+        # Force HLS demuxer and allow Smooth Streaming-style fMP4 fragment URLs
+        # "-f", "hls",
+        # "-allowed_extensions", "ALL",
+        "-i", m3u8_url,
+        *output_args,
+        "-c", "copy",
+        str(out_path),
+    ], check=True)
+
+
+def download_m3u8(m3u8_url: str, out_path: Path, metadata: Metadata) -> None:
     try:
-        subprocess.run([
-            "ffmpeg",
-            "-y",  # overwrite destination file without asking
-            "-headers", "Referer: https://mediasite.video.ufl.edu/\r\n"
-                        "Origin: https://mediasite.video.ufl.edu\r\n",
-            # Force HLS demuxer and allow Smooth Streaming-style fMP4 fragment URLs
-            # "-f", "hls",
-            # "-allowed_extensions", "ALL",
-            "-i", m3u8_url,
-            "-metadata", f"URL={metadata.url}",
-            "-metadata", f"title={metadata.title}",
-            "-metadata", f"artist={metadata.artist}",
-            "-c", "copy",
-            str(out_path),
-        ], check=True)
-    except subprocess.CalledProcessError as e:
-        err_msg = str(e) if e.stderr is None else e.stderr.decode()
+        fetch_m3u8(m3u8_url, out_path, get_metadata_args(metadata))
+    except (HlsError, subprocess.CalledProcessError) as e:
         send_notif(
-            "Error", f"Error downloading mediasite video: {metadata.title} {err_msg}"
+            "Error",
+            "Error downloading mediasite video: "
+            f"{metadata.title} {get_error_message(e)}"
         )
         sys.exit(1)
 
-def download_mediasite_video(out_path: Path, metadata: Metadata) -> None:
+
+def download_m3u8_streams(
+    streams: list[tuple[str, str]], out_path: Path, metadata: Metadata
+) -> None:
+    """Download every `(role, m3u8 URL)` stream concurrently and mux
+    them into one MKV with a video track titled after each role.
+    """
+    temp_paths = [out_path.with_name(f".{out_path.stem}.stream{i}.mkv")
+                  for i in range(len(streams))]
+    args = ["ffmpeg", "-y", "-loglevel", "error"]
+    for temp_path in temp_paths:
+        args += ["-i", str(temp_path)]
+    for i, (role, _) in enumerate(streams):
+        args += ["-map", str(i), f"-metadata:s:v:{i}", f"title={role}"]
+    # Play the first stream's tracks unless another is picked
+    args += ["-disposition:v", "0", "-disposition:a", "0",
+             "-disposition:v:0", "default", "-disposition:a:0", "default"]
+    args += [*get_metadata_args(metadata), "-c", "copy", str(out_path)]
+    # Every stream's segment fetchers share the session at once
+    get_session(HLS_WORKERS * len(streams))
+    try:
+        with ThreadPoolExecutor(max_workers=len(streams)) as pool:
+            futures = [
+                pool.submit(fetch_m3u8, m3u8_url, temp_path, [])
+                for (_, m3u8_url), temp_path in zip(streams, temp_paths)
+            ]
+            for future in futures:
+                future.result()
+        subprocess.run(args, check=True)
+    except (HlsError, subprocess.CalledProcessError) as e:
+        send_notif(
+            "Error",
+            "Error downloading mediasite video: "
+            f"{metadata.title} {get_error_message(e)}"
+        )
+        sys.exit(1)
+    finally:
+        for temp_path in temp_paths:
+            temp_path.unlink(missing_ok=True)
+
+
+def download_mediasite_video(
+    out_path: Path, metadata: Metadata, all_streams: bool = False
+) -> None:
+    """Download the presentation's first stream, or with `all_streams`
+    every stream (e.g. presenter camera and screen) as separate tracks.
+    """
     video_url = metadata.url
     video_id = video_url.rstrip("/").split("/")[-1]
-    # Extract cookies from Firefox for the domain
-    cookie_str = get_cookie_string("mediasite.video.ufl.edu")
-    # print(f"{cookie_str=}")
     # Get the JSON response for player options
-    json_data = get_player_options(cookie_str, video_url, video_id)
-    # Extract the m3u8 URL from the JSON response
-    m3u8_url = extract_mediasite_m3u8_url(json_data)
+    json_data = fetch_player_options(video_url, video_id)
+    # Extract the m3u8 URLs from the JSON response
+    if all_streams:
+        streams = extract_mediasite_streams(json_data)
+    else:
+        m3u8_url = extract_mediasite_m3u8_url(json_data)
+        streams = [] if m3u8_url is None else [("", m3u8_url)]
 
-    if m3u8_url is not None:
-        print("m3u8 URL found:", m3u8_url)
-        download_m3u8(m3u8_url, out_path, metadata)
+    if len(streams) == 1:
+        print("m3u8 URL found:", streams[0][1])
+        download_m3u8(streams[0][1], out_path, metadata)
+    elif streams:
+        print(f"m3u8 URLs found: {', '.join(role for role, _ in streams)}")
+        download_m3u8_streams(streams, out_path, metadata)
     else:
         print("Failed to extract m3u8 URL from JSON.")
         send_notif("Failed to extract m3u8 URL", "Do you have valid Gatorlink credentials?")
         sys.exit(1)
 
 
+def get_mediasite_file_path(metadata: Metadata) -> Path:
+    from yt_dlp.utils import sanitize_filename
+
+    dir_name = sanitize_filename(metadata.artist)
+    file_name = f"{sanitize_filename(metadata.title)}.mkv"
+    return VIDEOS_DIR / "mediasite" / dir_name / file_name
+
+
 def get_mediasite_metadata(url: str) -> tuple[Path, Metadata]:
     metadata = get_metadata_from_newsboat(url)
     if metadata is None:
         print("Newsboat data not found")
         send_notif("Error extracting metadata", "Newsboat data not found")
         sys.exit(1)
-    dir_name = sanitize_filename(metadata.artist)
-    file_name = f"{sanitize_filename(metadata.title)}.mkv"
-    file_path = VIDEOS_DIR / "mediasite" / dir_name / file_name
-    return file_path, metadata
+    return get_mediasite_file_path(metadata), metadata
 
 
 def main() -> None:
@@ -1,6 +1,8 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum, auto
+from pathlib import Path
+from typing import Optional
 
 
 @dataclass
@@ -8,6 +10,9 @@ class Metadata:
     url: str
     title: str
     artist: str
+    # (extractor, video ID) identity shared by every URL of the video,
+    # e.g. "youtube dQw4w9WgXcQ", when known from extraction
+    canonical_id: Optional[str] = None
 
 
 @dataclass
@@ -28,8 +33,114 @@ class NewsboatFeed:
     title: str
 
 
+@dataclass
+class PartialDownload:
+    url: str
+    temp_path: str
+    format_id: Optional[str]
+    bytes_done: int
+    updated_at: float
+
+
+@dataclass
+class VideoDetails:
+    size: Optional[int] = None
+    duration: Optional[float] = None  # seconds
+    container: Optional[str] = None
+    video_codec: Optional[str] = None
+    audio_codec: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    # yt-dlp format(s) the video was downloaded in, e.g. "137+140"
+    format_id: Optional[str] = None
+    downloaded_at: Optional[float] = None
+
+
+@dataclass
+class LibraryFile:
+    """A video file as last seen by a library rescan."""
+    path: Path
+    inode: int
+    size: int
+    mtime_ns: int
+    # The file's URL/title/artist tags, if it has a URL tag
+    tags: Optional[Metadata]
+    # None if the file hasn't been parsed for stream details
+    details: Optional[VideoDetails] = None
+
+
+@dataclass
+class RescanSummary:
+    scanned: int = 0
+    parsed: int = 0
+    added: int = 0
+    moved: int = 0
+    removed: int = 0
+    backfilled: int = 0
+    # Cached files dropped because their path is no longer in the library
+    forgotten: int = 0
+
+    def describe(self) -> str:
+        return (f"{self.scanned} files scanned ({self.parsed} parsed), "
+                f"{self.added} added, {self.moved} moved, "
+                f"{self.removed} removed, {self.backfilled} backfilled, "
+                f"{self.forgotten} cached files forgotten")
+
+
 class LinkType(Enum):
     ZOOM = auto()
     MEDIASITE = auto()
     INSTAGRAM = auto()
     DEFAULT = auto()
+
+
+@dataclass
+class Span:
+    """The time one download job spent in one stage."""
+    job_id: str
+    url: str
+    link_type: LinkType
+    stage: str
+    started_at: float
+    duration: float = 0.0
+    artist: Optional[str] = None
+    # Bytes the stage downloaded or wrote, for stages that move data
+    bytes: Optional[int] = None
+    ok: bool = True
+
+
+@dataclass
+class BulkJob:
+    """One entry of a bulk download as it moves through the pipeline."""
+    index: int
+    url: str
+    label: str
+    job_id: str
+    file_path: Optional[Path] = None
+    metadata: Optional[Metadata] = None
+    # Set once fetched if the video still needs post-processing
+    temp_dir: Optional[Path] = None
+    format_id: Optional[str] = None
+
+
+@dataclass
+class BulkSummary:
+    total: int
+    downloaded: int = 0
+    skipped: int = 0
+    failed: int = 0
+    canceled: bool = False
+    # Entries that failed, so callers can retry them later
+    failed_urls: list[str] = field(default_factory=list)
+
+    @property
+    def remaining(self) -> int:
+        return self.total - self.downloaded - self.skipped - self.failed
+
+    def describe(self) -> str:
+        parts = [f"{self.downloaded} downloaded"]
+        if self.skipped:
+            parts.append(f"{self.skipped} skipped")
+        if self.failed:
+            parts.append(f"{self.failed} failed")
+        return ", ".join(parts)
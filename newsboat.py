@@ -1,7 +1,11 @@
+from collections import namedtuple
+from functools import cache
+import json
 import sqlite3
 import sys
+import threading
 from datetime import datetime
-from typing import Optional
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional
 
 from constants import NEWSBOAT_DB_PATH
 from database import Metadata
@@ -40,6 +44,35 @@ from models import NewsboatFeed, NewsboatItem
 # );
 
 
+# Fields `iter_newsboat_feed_items` can select, mapped to their
+# `rss_item` column and the conversion applied to the raw value.
+FEED_ITEM_FIELDS: dict[str, tuple[str, Callable[[Any], Any]]] = {
+    "id": ("id", int),
+    "url": ("url", str),
+    "title": ("title", str),
+    "author": ("author", str),
+    "pub_date": ("pubDate", datetime.fromtimestamp),
+    "content": ("content", str),
+    "unread": ("unread", bool),
+}
+
+# Newsboat owns cache.db and may be writing to it, so we only ever open
+# it read-only, with one reused connection per thread.
+_local = threading.local()
+
+
+def get_newsboat_connection() -> Optional[sqlite3.Connection]:
+    conn: Optional[sqlite3.Connection] = getattr(_local, "conn", None)
+    if conn is None:
+        if not NEWSBOAT_DB_PATH.is_file():
+            return None
+        conn = sqlite3.connect(
+            f"{NEWSBOAT_DB_PATH.as_uri()}?mode=ro", uri=True
+        )
+        _local.conn = conn
+    return conn
+
+
 def newsboat_to_video_metadata(item: NewsboatItem) -> Metadata:
     return Metadata(
         url=item.url,
@@ -74,6 +107,33 @@ def fetch_newsboat_item_raw(
     return item
 
 
+def fetch_newsboat_items_raw(
+    cur: sqlite3.Cursor, urls: Iterable[str]
+) -> dict[str, NewsboatItem]:
+    """Looks up many items at once. `rss_item.url` has no index, so this
+    resolves the whole batch in a single scan of the table.
+    """
+    cur.execute("""
+    SELECT i.url, i.title, i.author, i.pubDate, i.content, i.unread,
+           f.title AS feed_title
+    FROM rss_item i
+    JOIN rss_feed f ON i.feedurl = f.rssurl
+    WHERE i.url IN (SELECT value FROM json_each(?))
+    """, (json.dumps(list(urls)),))
+    items = {}
+    for url, title, author, pub_date, content, unread, feed_title in cur:
+        items[url] = NewsboatItem(
+            url=url,
+            title=title,
+            author=author,
+            pub_date=datetime.fromtimestamp(pub_date),
+            content=content,
+            unread=bool(unread),
+            feed_title=feed_title,
+        )
+    return items
+
+
 def fetch_newsboat_items_by_feed_raw(
     cur: sqlite3.Cursor, feed: NewsboatFeed
 ) -> list[NewsboatItem]:
@@ -96,6 +156,46 @@ def fetch_newsboat_items_by_feed_raw(
     return items
 
 
+@cache
+def feed_item_record_type(fields: tuple[str, ...]) -> type[NamedTuple]:
+    """Compact (slotted, tuple-backed) record type for a field set."""
+    return namedtuple("FeedItemRecord", fields)  # type: ignore
+
+
+def iter_newsboat_feed_items_raw(
+    cur: sqlite3.Cursor,
+    feed: NewsboatFeed,
+    fields: tuple[str, ...],
+    only_unread: bool = False,
+    after_id: Optional[int] = None,
+    batch_size: int = 500,
+) -> Iterator[NamedTuple]:
+    """Streams a feed's items as records holding only `fields`, reading
+    `batch_size` rows at a time instead of loading the whole feed.
+    With `after_id`, only items newer than that `rss_item.id` are read,
+    in id order.
+    """
+    unknown = set(fields) - FEED_ITEM_FIELDS.keys()
+    if unknown:
+        raise ValueError(f"Unknown feed item fields: {sorted(unknown)}")
+    columns = ", ".join(FEED_ITEM_FIELDS[field][0] for field in fields)
+    converters = [FEED_ITEM_FIELDS[field][1] for field in fields]
+    record_type = feed_item_record_type(fields)
+    query = f"SELECT {columns} FROM rss_item WHERE feedurl = ?"
+    params: list[Any] = [feed.rssurl]
+    if only_unread:
+        query += " AND unread = 1"
+    if after_id is not None:
+        query += " AND id > ? ORDER BY id"
+        params.append(after_id)
+    cur.execute(query, params)
+    while rows := cur.fetchmany(batch_size):
+        for row in rows:
+            yield record_type(*(
+                convert(value) for convert, value in zip(converters, row)
+            ))
+
+
 def fetch_newsboat_feed_raw(
     cur: sqlite3.Cursor, url: str
 ) -> Optional[NewsboatFeed]:
@@ -113,25 +213,74 @@ def fetch_newsboat_feed_raw(
 
 
 def fetch_newsboat_item(url: str) -> Optional[NewsboatItem]:
-    if not NEWSBOAT_DB_PATH.is_file():
+    conn = get_newsboat_connection()
+    if conn is None:
+        return None
+    return fetch_newsboat_item_raw(conn.cursor(), url)
+
+
+def fetch_newsboat_items(urls: Iterable[str]) -> dict[str, NewsboatItem]:
+    """Returns the Newsboat items found for `urls`, keyed by URL."""
+    conn = get_newsboat_connection()
+    if conn is None:
+        return {}
+    return fetch_newsboat_items_raw(conn.cursor(), urls)
+
+
+def fetch_newsboat_feed(feed_url: str) -> Optional[NewsboatFeed]:
+    conn = get_newsboat_connection()
+    if conn is None:
         return None
-    with sqlite3.connect(NEWSBOAT_DB_PATH) as conn:
-        cur = conn.cursor()
-        return fetch_newsboat_item_raw(cur, url)
+    return fetch_newsboat_feed_raw(conn.cursor(), feed_url)
+
+
+def iter_newsboat_feed_items(
+    feed: NewsboatFeed,
+    fields: tuple[str, ...] = ("url", "title", "unread"),
+    only_unread: bool = False,
+    after_id: Optional[int] = None,
+    batch_size: int = 500,
+) -> Iterator[NamedTuple]:
+    conn = get_newsboat_connection()
+    if conn is None:
+        return iter(())
+    return iter_newsboat_feed_items_raw(
+        conn.cursor(), feed, fields, only_unread, after_id, batch_size
+    )
+
+
+def get_newsboat_max_item_id(feed: NewsboatFeed) -> int:
+    conn = get_newsboat_connection()
+    if conn is None:
+        return 0
+    cur = conn.execute(
+        "SELECT max(id) FROM rss_item WHERE feedurl = ?", (feed.rssurl,)
+    )
+    return cur.fetchone()[0] or 0
+
+
+def get_newsboat_data_version() -> Optional[int]:
+    """Changes whenever another connection (i.e. Newsboat) commits to
+    cache.db, which makes it a cheap way to poll for new items.
+    """
+    conn = get_newsboat_connection()
+    if conn is None:
+        return None
+    return conn.execute("PRAGMA data_version;").fetchone()[0]
 
 
 def fetch_newsboat_feed_and_items(
     feed_url: str
 ) -> tuple[Optional[NewsboatFeed], list[NewsboatItem]]:
-    if not NEWSBOAT_DB_PATH.is_file():
+    conn = get_newsboat_connection()
+    if conn is None:
+        return None, []
+    cur = conn.cursor()
+    feed = fetch_newsboat_feed_raw(cur, feed_url)
+    if feed is None:
         return None, []
-    with sqlite3.connect(NEWSBOAT_DB_PATH) as conn:
-        cur = conn.cursor()
-        feed = fetch_newsboat_feed_raw(cur, feed_url)
-        if feed is None:
-            return None, []
-        items = fetch_newsboat_items_by_feed_raw(cur, feed)
-        return feed, items
+    items = fetch_newsboat_items_by_feed_raw(cur, feed)
+    return feed, items
 
 
 def get_metadata_from_newsboat(url: str) -> Optional[Metadata]:
@@ -0,0 +1,71 @@
+from collections import deque
+from dataclasses import dataclass
+import time
+from typing import Callable, Generic, TypeVar
+
+
+T = TypeVar("T")
+
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    capacity: int
+    processed: int = 0
+    peak_backlog: int = 0
+    # Total seconds items spent in the backlog before the stage had room
+    wait_time: float = 0.0
+
+    def describe(self) -> str:
+        avg_wait = self.wait_time / self.processed if self.processed else 0.0
+        return (f"{self.name:<14}{self.processed:>6}{avg_wait:>11.1f}s"
+                f"{self.peak_backlog:>14}")
+
+
+class Stage(Generic[T]):
+    """One step of a pipeline. At most `workers + queue_size` items are
+    in flight (running or queued in the stage's pool); the rest wait in
+    a backlog. The backlog's size and waiting time are the backpressure
+    this stage puts on the stage before it.
+
+    Not thread-safe: a single coordinating thread calls `put` and
+    `done`, while `start` hands items to the stage's own worker pool.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        workers: int,
+        queue_size: int,
+        start: Callable[[T], None],
+    ) -> None:
+        self.stats = StageStats(name, workers, workers + queue_size)
+        self._start = start
+        self._backlog: deque[tuple[T, float]] = deque()
+        self._in_flight = 0
+
+    def put(self, item: T) -> None:
+        self._backlog.append((item, time.monotonic()))
+        self.stats.peak_backlog = max(self.stats.peak_backlog,
+                                      len(self._backlog))
+        self._pump()
+
+    def done(self) -> None:
+        """Marks one started item as finished, making room for the next."""
+        self._in_flight -= 1
+        self.stats.processed += 1
+        self._pump()
+
+    def _pump(self) -> None:
+        while self._backlog and self._in_flight < self.stats.capacity:
+            item, queued_at = self._backlog.popleft()
+            self.stats.wait_time += time.monotonic() - queued_at
+            self._in_flight += 1
+            self._start(item)
+
+
+def print_stage_report(stages: list[Stage]) -> None:
+    print(f"\n{'stage':<14}{'done':>6}{'avg wait':>12}{'peak backlog':>14}")
+    for stage in stages:
+        print(stage.stats.describe())
@@ -0,0 +1,235 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+import queue
+import threading
+import time
+from typing import Any, Callable, Generic, Iterator, Optional, TypeVar
+
+from models import LinkType
+
+
+T = TypeVar("T")
+
+# Seconds between throughput measurements of the adaptive controller
+ADAPT_INTERVAL = 10.0
+# An extra worker is kept only if it raised throughput by this much
+ADAPT_MIN_GAIN = 0.1
+# Intervals to wait after a worker didn't help before probing again
+ADAPT_HOLD_INTERVALS = 6
+# Throughput this close to the bandwidth budget can't be improved on
+ADAPT_CAP_FRACTION = 0.9
+
+
+@dataclass
+class _Job(Generic[T]):
+    item: T
+    link_type: LinkType
+    fn: Callable[..., Any]
+    args: tuple[Any, ...] = field(default_factory=tuple)
+
+
+class DownloadScheduler(Generic[T]):
+    """Runs jobs on a thread pool while capping how many run at once,
+    both overall and per link type.
+
+    Finished jobs are handed back through `completed` so that the
+    submitting thread can do its own bookkeeping (e.g. database writes)
+    without sharing a connection with the workers.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        link_type_limits: dict[LinkType, int],
+        done_queue: Optional[queue.Queue[tuple[T, Future[Any]]]] = None,
+    ) -> None:
+        """Finished jobs are put on `done_queue` if given, e.g. to share
+        one queue between several pools; `completed` is then unused.
+        """
+        self.max_workers = max_workers
+        # Jobs allowed to run at once; may be lowered below max_workers
+        self.concurrency = max_workers
+        self.link_type_limits = link_type_limits
+        self.cancel_event = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.RLock()
+        self._pending: deque[_Job[T]] = deque()
+        self._running: dict[LinkType, int] = {}
+        self._done = queue.Queue() if done_queue is None else done_queue
+        self._outstanding = 0
+
+    def __enter__(self) -> "DownloadScheduler[T]":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _limit(self, link_type: LinkType) -> int:
+        return self.link_type_limits.get(link_type, self.max_workers)
+
+    def _dispatch(self) -> None:
+        """Starts as many pending jobs as the limits allow, preserving
+        submission order within each link type.
+        """
+        with self._lock:
+            if self.cancel_event.is_set():
+                return
+            total = sum(self._running.values())
+            started = []
+            for job in self._pending:
+                if total >= min(self.concurrency, self.max_workers):
+                    break
+                running = self._running.get(job.link_type, 0)
+                if running >= self._limit(job.link_type):
+                    continue
+                self._running[job.link_type] = running + 1
+                total += 1
+                started.append(job)
+            for job in started:
+                self._pending.remove(job)
+            for job in started:
+                future = self._executor.submit(job.fn, *job.args)
+                future.add_done_callback(
+                    lambda f, job=job: self._on_done(job, f)
+                )
+
+    def _on_done(self, job: _Job[T], future: Future[Any]) -> None:
+        with self._lock:
+            self._running[job.link_type] -= 1
+            self._done.put((job.item, future))
+            self._dispatch()
+
+    def set_concurrency(self, concurrency: int) -> None:
+        """Changes how many jobs may run at once (between 1 and
+        `max_workers`). Lowering it lets running jobs finish.
+        """
+        with self._lock:
+            self.concurrency = max(1, min(concurrency, self.max_workers))
+        self._dispatch()
+
+    def backlog(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def running(self) -> int:
+        with self._lock:
+            return sum(self._running.values())
+
+    def submit(
+        self,
+        item: T,
+        link_type: LinkType,
+        fn: Callable[..., Any],
+        *args: Any,
+    ) -> None:
+        """Queues `fn(*args)`; `item` is returned with its future once
+        the job finishes.
+        """
+        with self._lock:
+            self._pending.append(_Job(item, link_type, fn, args))
+            self._outstanding += 1
+        self._dispatch()
+
+    def completed(self, block: bool = True) -> Iterator[tuple[T, Future[Any]]]:
+        """Yields finished jobs in completion order. When blocking, waits
+        until every submitted job has finished; otherwise only yields the
+        jobs that are already done.
+        """
+        while True:
+            with self._lock:
+                if self._outstanding == 0:
+                    return
+            try:
+                item, future = self._done.get(block=block)
+            except queue.Empty:
+                return
+            with self._lock:
+                self._outstanding -= 1
+            yield item, future
+
+    def cancel(self) -> list[T]:
+        """Stops starting new jobs, signals running jobs through
+        `cancel_event` and waits for them to wind down. Returns the items
+        that never started.
+        """
+        self.cancel_event.set()
+        with self._lock:
+            not_started = [job.item for job in self._pending]
+            self._outstanding -= len(self._pending)
+            self._pending.clear()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        return not_started
+
+
+class AdaptiveConcurrency:
+    """Tunes a scheduler's concurrency by hill climbing on aggregate
+    throughput: while jobs are waiting and every slot is busy, one more
+    job is allowed to run. If throughput didn't rise by ADAPT_MIN_GAIN
+    over the next interval the extra slot is taken away again and no
+    probing happens for ADAPT_HOLD_INTERVALS intervals.
+
+    `measure` returns the total bytes transferred so far and `get_cap`
+    the bandwidth budget in bytes per second (None if unlimited). Each
+    new job is given an interval to get going before it is judged.
+    """
+
+    def __init__(
+        self,
+        scheduler: DownloadScheduler[Any],
+        measure: Callable[[], int],
+        get_cap: Callable[[], Optional[float]],
+        interval: float = ADAPT_INTERVAL,
+    ) -> None:
+        self.scheduler = scheduler
+        self.measure = measure
+        self.get_cap = get_cap
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        # Throughput before the current probe, while one is running
+        self._baseline: Optional[float] = None
+        self._settling = False
+        self._hold = 0
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        last_bytes = self.measure()
+        last_time = time.monotonic()
+        while not self._stop.wait(self.interval):
+            now_bytes, now_time = self.measure(), time.monotonic()
+            self.step((now_bytes - last_bytes) / (now_time - last_time))
+            last_bytes, last_time = now_bytes, now_time
+
+    def step(self, throughput: float) -> None:
+        """Adjusts concurrency given the bytes per second transferred
+        over the last interval.
+        """
+        scheduler = self.scheduler
+        if self._settling:
+            self._settling = False
+            return
+        if self._baseline is not None:
+            if throughput < self._baseline * (1 + ADAPT_MIN_GAIN):
+                scheduler.set_concurrency(scheduler.concurrency - 1)
+                self._hold = ADAPT_HOLD_INTERVALS
+            self._baseline = None
+            return
+        if self._hold > 0:
+            self._hold -= 1
+            return
+        cap = self.get_cap()
+        if cap is not None and throughput >= cap * ADAPT_CAP_FRACTION:
+            return
+        saturated = scheduler.running() >= scheduler.concurrency
+        if scheduler.backlog() and saturated \
+                and scheduler.concurrency < scheduler.max_workers:
+            self._baseline = throughput
+            self._settling = True
+            scheduler.set_concurrency(scheduler.concurrency + 1)
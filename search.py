@@ -0,0 +1,31 @@
+import sys
+
+from database import get_artists, get_videos_by_artist, search_videos
+
+
+def print_usage() -> None:
+    print("Invalid arguments.", file=sys.stderr)
+    print("\tFormat: <QUERY>...", file=sys.stderr)
+    print("\t        --artist <ARTIST>", file=sys.stderr)
+    print("\t        --artists", file=sys.stderr)
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    if args == ["--artists"]:
+        for artist, count in get_artists():
+            print(f"{artist}\t{count}", flush=True)
+    elif len(args) == 2 and args[0] == "--artist":
+        for _, metadata in get_videos_by_artist(args[1]):
+            print(f"{metadata.title}\t{metadata.url}", flush=True)
+    elif args and not args[0].startswith("--"):
+        for _, metadata in search_videos(" ".join(args)):
+            print(f"{metadata.artist} - {metadata.title}\t{metadata.url}",
+                  flush=True)
+    else:
+        print_usage()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import math
+import sys
+import time
+from typing import Iterable
+
+from database import get_spans_since
+from models import Span
+
+
+DEFAULT_WINDOW_DAYS = 30
+STAGES = ("resolve", "fetch", "post-process", "register")
+# Uploaders listed, most downloaded first
+MAX_UPLOADERS = 20
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of sorted `values`."""
+    rank = max(1, math.ceil(q / 100 * len(values)))
+    return values[rank - 1]
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1:
+        return f"{seconds * 1e3:.0f}ms"
+    if seconds < 120:
+        return f"{seconds:.1f}s"
+    return f"{seconds / 60:.1f}m"
+
+
+def format_throughput(spans: Iterable[Span]) -> str:
+    """Median throughput of the spans that moved any bytes."""
+    rates = sorted(span.bytes / span.duration for span in spans
+                   if span.bytes and span.duration > 0)
+    if not rates:
+        return "-"
+    return f"{percentile(rates, 50) / 1e6:.1f} MB/s"
+
+
+def format_row(name: str, spans: list[Span]) -> str:
+    durations = sorted(span.duration for span in spans)
+    failed = sum(not span.ok for span in spans)
+    return (f"{name:<24}{len(durations):>6}{failed:>8}"
+            + "".join(f"{format_seconds(percentile(durations, q)):>9}"
+                      for q in (50, 90, 99))
+            + f"{format_throughput(spans):>14}")
+
+
+def print_header(name: str) -> None:
+    print(f"{name:<24}{'count':>6}{'failed':>8}{'p50':>9}{'p90':>9}"
+          f"{'p99':>9}{'throughput':>14}")
+
+
+def print_by_link_type(spans: list[Span]) -> None:
+    groups: dict[tuple[str, str], list[Span]] = {}
+    for span in spans:
+        groups.setdefault((span.link_type.name, span.stage), []).append(span)
+    print_header("link type / stage")
+    for (link_type, stage), group in sorted(
+        groups.items(), key=lambda item: (item[0][0], STAGES.index(item[0][1]))
+    ):
+        print(format_row(f"{link_type.lower()} {stage}", group))
+
+
+def print_by_uploader(spans: list[Span]) -> None:
+    """Per uploader, the total time of each job (its stages summed) and
+    the throughput of its fetches.
+    """
+    jobs: dict[str, list[Span]] = {}
+    for span in spans:
+        jobs.setdefault(span.job_id, []).append(span)
+    by_uploader: dict[str, list[Span]] = {}
+    for job_spans in jobs.values():
+        artist = next((s.artist for s in job_spans if s.artist), "Unknown")
+        fetches = [s for s in job_spans if s.stage == "fetch"]
+        job = Span(
+            job_spans[0].job_id,
+            job_spans[0].url,
+            job_spans[0].link_type,
+            "job",
+            job_spans[0].started_at,
+            duration=sum(s.duration for s in job_spans),
+            artist=artist,
+            bytes=sum(s.bytes or 0 for s in fetches),
+            ok=all(s.ok for s in job_spans),
+        )
+        by_uploader.setdefault(artist, []).append(job)
+    print_header("uploader (whole jobs)")
+    ranked = sorted(by_uploader.items(), key=lambda item: -len(item[1]))
+    for artist, group in ranked[:MAX_UPLOADERS]:
+        print(format_row(artist[:23], group))
+
+
+def main() -> None:
+    try:
+        if len(sys.argv) > 2:
+            raise ValueError
+        days = float(sys.argv[1]) if len(sys.argv) == 2 \
+            else DEFAULT_WINDOW_DAYS
+    except ValueError:
+        print("Invalid arguments.", file=sys.stderr)
+        print("\tFormat: [DAYS]", file=sys.stderr)
+        sys.exit(1)
+
+    spans = get_spans_since(time.time() - days * 24 * 60 * 60)
+    if not spans:
+        print(f"No downloads in the last {days:g} days")
+        return
+    job_count = len({span.job_id for span in spans})
+    print(f"{job_count} jobs in the last {days:g} days\n")
+    print_by_link_type(spans)
+    print()
+    print_by_uploader(spans)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+from pathlib import Path
+import queue
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import toml
+
+import database
+import download
+from config import Config
+from models import Metadata
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def make_config(**download_settings: object) -> Config:
+    data = toml.load(ROOT / "config.toml.example")
+    data["download"].update(download_settings)
+    return Config(**data)
+
+
+class IsolatedDatabaseTest(unittest.TestCase):
+    """Points the database at a fresh file for each test."""
+
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        data_path = self.tmp / "data"
+        for patch in (
+            mock.patch.object(database, "MANAGER_DATA_PATH", data_path),
+            mock.patch.object(database, "MANAGER_METADATA_PATH",
+                              data_path / "metadata.db"),
+            mock.patch.object(database, "_local", threading.local()),
+            mock.patch("builtins.print"),
+            mock.patch.object(download, "send_notif"),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+
+class InterruptingQueue(queue.Queue):
+    """Raises KeyboardInterrupt (as Ctrl-C would) the first time it is
+    read once `after` fetch events have been handed out.
+    """
+
+    def __init__(self, after: int) -> None:
+        super().__init__()
+        self.after = after
+        self.fetched = 0
+        self.interrupted = False
+
+    def get(self, *args, **kwargs):
+        if self.fetched == self.after and not self.interrupted:
+            self.interrupted = True
+            raise KeyboardInterrupt
+        item = super().get(*args, **kwargs)
+        if item[0][0] == "fetch":
+            self.fetched += 1
+        return item
+
+
+class CancelBulkDownloadTest(IsolatedDatabaseTest):
+    def test_queued_post_process_keeps_existing_same_title_file(self) -> None:
+        videos = self.tmp / "videos"
+        videos.mkdir()
+        first = Metadata("https://example.com/a", "First", "Chan")
+        second = Metadata("https://example.com/b", "Q&A", "Chan")
+        paths = {first.url: videos / "First.mkv",
+                 second.url: videos / "Q&A.mkv"}
+        # A different, already downloaded video with the second's title
+        existing = paths[second.url]
+        existing.write_bytes(b"another video")
+        registered = []
+
+        def get_metadata(job_id, url, config, newsboat_metadata=None,
+                         skip_newsboat=False):
+            return paths[url], first if url == first.url else second
+
+        def fetch(job_id, file_path, metadata, config, cancel_event=None,
+                  concurrent_downloads=1):
+            if metadata is second:
+                time.sleep(0.05)  # reach post-processing after the first
+            temp_dir = self.tmp / metadata.title
+            temp_dir.mkdir()
+            (temp_dir / f"{download.TEMP_VIDEO_NAME}.mkv").write_bytes(b"v")
+            database.save_partial_download(metadata.url, temp_dir)
+            return temp_dir
+
+        def post_process(job_id, temp_dir, file_path, metadata, config):
+            # Keeps the only worker busy so the second job stays queued
+            time.sleep(0.2)
+            file_path.write_bytes(b"new video")
+
+        def register(job_id, file_path, metadata, format_id, config):
+            registered.append(metadata.url)
+            database.clear_reservation(metadata.url)
+
+        events = InterruptingQueue(after=2)
+        with mock.patch.object(download, "timed_get_metadata", get_metadata), \
+                mock.patch.object(download, "timed_fetch_video", fetch), \
+                mock.patch.object(download, "timed_post_process_video",
+                                  post_process), \
+                mock.patch.object(download, "register_video", register), \
+                mock.patch.object(download.queue, "Queue",
+                                  lambda: events):
+            summary = download.run_bulk_download(
+                [(first.url, "first"), (second.url, "second")],
+                make_config(max_concurrent_postprocess=1),
+            )
+
+        self.assertTrue(summary.canceled)
+        self.assertEqual(summary.failed, 0)
+        self.assertEqual(registered, [first.url])
+        self.assertEqual(existing.read_bytes(), b"another video")
+        # The canceled job resumes from its fetched files next time
+        partial = database.get_partial_download(second.url)
+        self.assertIsNotNone(partial)
+        self.assertTrue(Path(partial.temp_path).is_dir())
+        self.assertIsNone(database.get_download_in_progress(second.url))
+
+
+class BulkResolveTest(IsolatedDatabaseTest):
+    def test_batch_lookup_misses_skip_per_url_newsboat_query(self) -> None:
+        url = "https://example.com/not-in-a-feed"
+        file_path = self.tmp / "video.mkv"
+        per_url_lookup = mock.Mock(return_value=None)
+        yt_dlp_lookup = mock.Mock(
+            return_value=(file_path, Metadata(url, "Title", "Chan"))
+        )
+
+        def fetch(job_id, file_path, metadata, config, cancel_event=None,
+                  concurrent_downloads=1):
+            file_path.write_bytes(b"video")
+
+        def register(job_id, file_path, metadata, format_id, config):
+            database.clear_reservation(metadata.url)
+
+        with mock.patch.object(download, "get_metadata_from_newsboat",
+                               per_url_lookup), \
+                mock.patch.object(download, "get_metadata_with_yt_dlp",
+                                  yt_dlp_lookup), \
+                mock.patch.object(download, "timed_fetch_video", fetch), \
+                mock.patch.object(download, "register_video", register):
+            # An empty batch lookup: the URL isn't in Newsboat
+            summary = download.run_bulk_download(
+                [(url, url)], make_config(), {}
+            )
+
+        self.assertEqual(summary.downloaded, 1)
+        per_url_lookup.assert_not_called()
+        yt_dlp_lookup.assert_called_once_with(url)
+
+
+class CliRateLimitTest(unittest.TestCase):
+    def limit_rate(self, concurrent_downloads: int) -> str:
+        config = make_config(rate_limit=8, max_concurrent_downloads=4)
+        metadata = Metadata("https://example.com/v", "Title", "Chan")
+        with mock.patch.object(download.subprocess, "run") as run:
+            download.download_with_yt_dlp_cli(
+                metadata, Path("/tmp"), config,
+                concurrent_downloads=concurrent_downloads,
+            )
+        args = run.call_args.args[0]
+        return args[args.index("--limit-rate") + 1]
+
+    def test_single_download_gets_whole_rate(self) -> None:
+        self.assertEqual(self.limit_rate(1), str(8 << 20))
+
+    def test_concurrent_downloads_split_rate(self) -> None:
+        self.assertEqual(self.limit_rate(4), str(2 << 20))
+
+
+if __name__ == "__main__":
+    unittest.main()
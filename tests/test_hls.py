@@ -0,0 +1,197 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+import hls
+
+
+SEGMENT_COUNT = 6
+# Requests for these paths fail with a 503 this many times first
+FLAKY_FAILURES = 2
+
+
+def segment_data(i: int) -> bytes:
+    return f"segment {i};".encode() * 100
+
+
+# One file holding every segment, addressed with EXT-X-BYTERANGE
+RANGE_FILE = b"".join(segment_data(i) for i in range(SEGMENT_COUNT))
+RANGE_LENGTH = len(segment_data(0))
+
+MASTER_PLAYLIST = """#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360
+low/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=2400000,RESOLUTION=1280x720
+high/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=1200000,RESOLUTION=960x540
+mid/index.m3u8
+"""
+
+
+def media_playlist(segment_names: list[str]) -> str:
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:4"]
+    for name in segment_names:
+        lines += ["#EXTINF:4.0,", name]
+    return "\n".join(lines + ["#EXT-X-ENDLIST", ""])
+
+
+def byte_range_playlist() -> str:
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:4"]
+    for i in range(SEGMENT_COUNT):
+        # Offsets after the first are implied by the previous range
+        spec = f"{RANGE_LENGTH}@0" if i == 0 else str(RANGE_LENGTH)
+        lines += ["#EXTINF:4.0,", f"#EXT-X-BYTERANGE:{spec}", "all.bin"]
+    return "\n".join(lines + ["#EXT-X-ENDLIST", ""])
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    server: "StandInServer"
+
+    def log_message(self, *_: object) -> None:
+        pass
+
+    def send_body(self, body: bytes, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        path = self.path.lstrip("/")
+        with self.server.lock:
+            self.server.requests.append(path)
+            failures = self.server.failures.get(path, 0)
+            if failures:
+                self.server.failures[path] = failures - 1
+        if failures:
+            self.send_body(b"try again", 503)
+            return
+        if path == "master.m3u8":
+            self.send_body(MASTER_PLAYLIST.encode())
+        elif path.endswith("index.m3u8"):
+            variant = path.partition("/")[0]
+            names = [f"{variant}-{i}.ts" for i in range(SEGMENT_COUNT)]
+            self.send_body(media_playlist(names).encode())
+        elif path == "ranges.m3u8":
+            self.send_body(byte_range_playlist().encode())
+        elif path == "all.bin":
+            self.send_range()
+        elif path.endswith(".ts"):
+            i = int(path.rpartition("-")[2].removesuffix(".ts"))
+            # Later segments finish first, so completion order differs
+            # from playlist order
+            time.sleep(0.02 * (SEGMENT_COUNT - i))
+            self.send_body(segment_data(i))
+        else:
+            self.send_body(b"not found", 404)
+
+    def send_range(self) -> None:
+        spec = self.headers.get("Range")
+        if spec is None:
+            self.send_body(RANGE_FILE)
+            return
+        start, _, end = spec.removeprefix("bytes=").partition("-")
+        body = RANGE_FILE[int(start):int(end) + 1]
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header(
+            "Content-Range", f"bytes {start}-{end}/{len(RANGE_FILE)}"
+        )
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.lock = threading.Lock()
+        self.requests: list[str] = []
+        self.failures: dict[str, int] = {}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+
+class HlsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = StandInServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.session = requests.Session()
+        self.addCleanup(self.session.close)
+
+    def url(self, path: str) -> str:
+        return self.server.base_url + path
+
+    def write(self, playlist: hls.MediaPlaylist, workers: int = 4) -> bytes:
+        out = io.BytesIO()
+        with mock.patch("builtins.print"):
+            hls.write_segments(out, self.session, playlist, {}, workers)
+        return out.getvalue()
+
+    def test_picks_highest_bandwidth_variant(self) -> None:
+        playlist = hls.fetch_playlist(
+            self.session, self.url("master.m3u8"), {}
+        )
+        self.assertEqual(
+            [segment.url for segment in playlist.segments],
+            [self.url(f"high/high-{i}.ts") for i in range(SEGMENT_COUNT)],
+        )
+        self.assertNotIn("low/index.m3u8", self.server.requests)
+        self.assertNotIn("mid/index.m3u8", self.server.requests)
+
+    def test_writes_segments_in_playlist_order(self) -> None:
+        playlist = hls.fetch_playlist(
+            self.session, self.url("high/index.m3u8"), {}
+        )
+        data = self.write(playlist, workers=SEGMENT_COUNT)
+        expected = b"".join(segment_data(i) for i in range(SEGMENT_COUNT))
+        self.assertEqual(data, expected)
+
+    def test_retries_transient_server_errors(self) -> None:
+        self.server.failures["high/high-2.ts"] = FLAKY_FAILURES
+        playlist = hls.fetch_playlist(
+            self.session, self.url("high/index.m3u8"), {}
+        )
+        with mock.patch.object(hls, "HLS_RETRY_BACKOFF", 0):
+            data = self.write(playlist)
+        expected = b"".join(segment_data(i) for i in range(SEGMENT_COUNT))
+        self.assertEqual(data, expected)
+        self.assertEqual(
+            self.server.requests.count("high/high-2.ts"), FLAKY_FAILURES + 1
+        )
+
+    def test_gives_up_after_repeated_failures(self) -> None:
+        self.server.failures["high/high-0.ts"] = hls.HLS_SEGMENT_ATTEMPTS
+        playlist = hls.fetch_playlist(
+            self.session, self.url("high/index.m3u8"), {}
+        )
+        with mock.patch.object(hls, "HLS_RETRY_BACKOFF", 0):
+            with self.assertRaises(hls.HlsError):
+                self.write(playlist)
+
+    def test_byte_ranges(self) -> None:
+        playlist = hls.fetch_playlist(
+            self.session, self.url("ranges.m3u8"), {}
+        )
+        self.assertEqual(
+            [segment.byte_range for segment in playlist.segments],
+            [(RANGE_LENGTH, i * RANGE_LENGTH) for i in range(SEGMENT_COUNT)],
+        )
+        self.assertEqual(self.write(playlist), RANGE_FILE)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+from pathlib import Path
+import unittest
+from unittest import mock
+
+import database
+import download
+import library
+from models import LibraryFile, Metadata, VideoDetails
+from tests.test_download import IsolatedDatabaseTest, make_config
+
+
+def fake_parse(path: Path, st: os.stat_result) -> LibraryFile:
+    """Tags every file with a URL made from its name."""
+    tags = Metadata(f"https://example.com/{path.stem}", path.stem, "Chan")
+    return LibraryFile(path, *library.get_identity(st), tags,
+                       VideoDetails(size=st.st_size))
+
+
+def cached_paths() -> set[Path]:
+    return {f.path for f in database.get_library_files()}
+
+
+class LibraryCacheTest(IsolatedDatabaseTest):
+    def setUp(self) -> None:
+        super().setUp()
+        patch = mock.patch.object(library, "parse_video_file", fake_parse)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.root = self.tmp / "videos"
+        self.root.mkdir()
+
+    def test_rescan_forgets_paths_it_did_not_see(self) -> None:
+        kept = self.root / "kept.mkv"
+        kept.write_bytes(b"kept")
+        outside = self.tmp / "outside.mkv"
+        outside.write_bytes(b"outside")
+        removed = self.root / "removed.mkv"
+        removed.write_bytes(b"removed")
+        for path in (kept, outside, removed):
+            library.read_video_file(path)
+        removed.unlink()
+
+        summary = library.rescan_library(self.root, workers=1)
+
+        self.assertEqual(cached_paths(), {kept})
+        self.assertEqual(summary.forgotten, 2)
+
+    def test_post_process_moves_cached_temp_file(self) -> None:
+        metadata = Metadata("https://example.com/video", "Title", "Chan")
+        file_path = self.root / "Title.mkv"
+        temp_dir = download.get_temp_dir(file_path, metadata.url)
+        temp_dir.mkdir()
+        temp_path = temp_dir / f"{download.TEMP_VIDEO_NAME}.mkv"
+        temp_path.write_bytes(b"video")
+
+        download.post_process_video(temp_dir, file_path, metadata,
+                                    make_config())
+
+        self.assertTrue(file_path.is_file())
+        self.assertEqual(cached_paths(), {file_path})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+
+import watch
+from config import WatchFeedConfig
+from database import get_watch_position
+from models import BulkSummary, Metadata
+from tests.test_download import IsolatedDatabaseTest, make_config
+
+
+RSSURL = "https://example.com/feed.xml"
+BROKEN = Metadata("https://example.com/private", "Private video", "Chan")
+WORKING = Metadata("https://example.com/ok", "Fine video", "Chan")
+LAST_ID = 20
+
+
+def find_new_items(feed_config: WatchFeedConfig):
+    return RSSURL, [(11, BROKEN), (12, WORKING)], LAST_ID
+
+
+class WatchRetryTest(IsolatedDatabaseTest):
+    def setUp(self) -> None:
+        super().setUp()
+        self.attempted: list[list[str]] = []
+        for patch in (
+            mock.patch.object(watch, "find_new_items", find_new_items),
+            mock.patch.object(watch, "run_bulk_download", self.download),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        notify_patch = mock.patch.object(watch, "send_notif")
+        self.notify = notify_patch.start()
+        self.addCleanup(notify_patch.stop)
+
+    def download(self, entries, config, newsboat_metadata):
+        urls = [url for url, _ in entries]
+        self.attempted.append(urls)
+        summary = BulkSummary(total=len(urls))
+        for url in urls:
+            if url == BROKEN.url:
+                summary.failed += 1
+                summary.failed_urls.append(url)
+            else:
+                summary.downloaded += 1
+        return summary
+
+    def config(self, **watch_settings: object):
+        config = make_config()
+        config.watch.feeds = [WatchFeedConfig(url=RSSURL)]
+        for key, value in watch_settings.items():
+            setattr(config.watch, key, value)
+        return config
+
+    def test_gives_up_after_max_attempts(self) -> None:
+        config = self.config(max_attempts=3, retry_backoff=0)
+        for _ in range(config.watch.max_attempts - 1):
+            self.assertTrue(watch.sync_feeds(config))
+            self.assertEqual(get_watch_position(RSSURL), 10)
+        self.assertTrue(watch.sync_feeds(config))
+        self.assertEqual(get_watch_position(RSSURL), LAST_ID)
+        self.assertTrue(watch.sync_feeds(config))
+
+        broken_attempts = sum(BROKEN.url in urls for urls in self.attempted)
+        self.assertEqual(broken_attempts, config.watch.max_attempts)
+        give_ups = [call for call in self.notify.call_args_list
+                    if call.args[0] == "Giving Up"]
+        self.assertEqual(len(give_ups), 1)
+
+    def test_waits_out_backoff_before_retrying(self) -> None:
+        config = self.config(retry_backoff=3600)
+        watch.sync_feeds(config)
+        watch.sync_feeds(config)
+        self.assertEqual(self.attempted[0], [BROKEN.url, WORKING.url])
+        # Too soon to retry the broken item (the stub never registers
+        # the working one, so it is attempted every time)
+        self.assertEqual(self.attempted[1:], [[WORKING.url]])
+        self.assertEqual(get_watch_position(RSSURL), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
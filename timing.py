@@ -0,0 +1,81 @@
+import cProfile
+from contextlib import contextmanager
+import sqlite3
+import threading
+import time
+from typing import Iterator, Optional
+import uuid
+
+from constants import PROFILES_DIR
+from database import insert_span
+from models import Span
+from util import get_link_type
+
+
+# Only one cProfile profiler can be active per process
+_profile_lock = threading.Lock()
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def start_profiler() -> Optional[cProfile.Profile]:
+    """Returns a running profiler, or None if another stage is being
+    profiled.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # some other profiling tool is active
+        _profile_lock.release()
+        return None
+    return profiler
+
+
+def stop_profiler(profiler: cProfile.Profile, span: Span) -> None:
+    profiler.disable()
+    _profile_lock.release()
+    PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+    profile_path = PROFILES_DIR / f"{span.job_id}-{span.stage}.prof"
+    profiler.dump_stats(profile_path)
+    print(f"Wrote profile: {profile_path}")
+
+
+@contextmanager
+def record_span(
+    job_id: str,
+    url: str,
+    stage: str,
+    artist: Optional[str] = None,
+    profile: bool = False,
+) -> Iterator[Span]:
+    """Times the body as one stage of a job and records it in the
+    database, whether or not it succeeds. The body may fill in the
+    span's `bytes` and `artist`.
+
+    With `profile`, the body runs under cProfile and the stats are
+    dumped to PROFILES_DIR/<job>-<stage>.prof (view with
+    `python -m pstats` or snakeviz). Only one stage is profiled at a
+    time, and the profile covers every thread running meanwhile.
+    """
+    span = Span(job_id, url, get_link_type(url), stage, time.time(),
+                artist=artist)
+    profiler = start_profiler() if profile else None
+    start = time.perf_counter()
+    try:
+        yield span
+    except BaseException:
+        span.ok = False
+        raise
+    finally:
+        span.duration = time.perf_counter() - start
+        if profiler is not None:
+            stop_profiler(profiler, span)
+        try:
+            insert_span(span)
+        except sqlite3.Error as e:
+            # Losing a timing is better than failing the download
+            print(f"Could not record {stage} span: {e}")
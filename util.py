@@ -1,14 +1,16 @@
+import atexit
 import os
 import platform
+import queue
 import re
-import psutil
 import subprocess
 import sys
+import threading
+import time
 from pathlib import Path
 from typing import Literal, Optional
-from pymediainfo import MediaInfo
 
-from models import LinkType, Metadata
+from models import LinkType, Metadata, VideoDetails
 
 
 def get_link_type(url: str) -> LinkType:
@@ -26,76 +28,198 @@ def get_link_type(url: str) -> LinkType:
 
 
 type System = Literal["Linux", "Darwin", "Windows"]
-# TODO: add link to file for download complete notification
-def send_notif(title: str, msg: str) -> None:
+
+# Notifications arriving within this window of each other are coalesced
+NOTIF_COALESCE_WINDOW = 0.5
+# Minimum gap between two bursts of desktop notifications
+NOTIF_MIN_INTERVAL = 2.0
+# How long exiting processes wait for pending notifications to be shown
+NOTIF_FLUSH_TIMEOUT = 5.0
+# Messages listed in a coalesced notification before "and N more"
+NOTIF_MAX_LINES = 3
+
+
+def get_notifier_command(title: str, msg: str) -> Optional[list[str]]:
     system: System = platform.system() # type: ignore
     match system:
         case "Linux":
-            try:
-                subprocess.run([
-                    "notify-send",
-                    "--hint=int:transient:1",
-                    "--urgency=normal",
-                    title,
-                    msg,
-                ], check=True)
-            except FileNotFoundError:
-                print("`notify-send` not found. "
-                      "See README for installation instructions.",
-                      file=sys.stderr)
-            except subprocess.CalledProcessError as e:
-                print(f"Error running notify-send: {e}", file=sys.stderr)
-
+            return [
+                "notify-send",
+                "--hint=int:transient:1",
+                "--urgency=normal",
+                title,
+                msg,
+            ]
         case "Darwin":
-            try:
-                subprocess.run([
-                    "terminal-notifier",
-                    "-title",
-                    title,
-                    "-message",
-                    msg,
-                ], check=True)
-            except FileNotFoundError:
-                print("`terminal-notifier` not found. "
-                      "See README for installation instructions.",
-                      file=sys.stderr)
-            except subprocess.CalledProcessError as e:
-                print(f"Error running terminal-notifier: {e}", file=sys.stderr)
-
+            return ["terminal-notifier", "-title", title, "-message", msg]
         case "Windows":
-            pass
+            return None
+
+
+def coalesce_notifs(notifs: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """Merges notifications that share a title into one, e.g. twelve
+    "Finished Download" notifications become "Finished Download (12)".
+    """
+    grouped: dict[str, list[str]] = {}
+    for title, msg in notifs:
+        grouped.setdefault(title, []).append(msg)
+    merged = []
+    for title, msgs in grouped.items():
+        if len(msgs) == 1:
+            merged.append((title, msgs[0]))
+            continue
+        lines = msgs[:NOTIF_MAX_LINES]
+        if len(msgs) > NOTIF_MAX_LINES:
+            lines.append(f"and {len(msgs) - NOTIF_MAX_LINES} more")
+        merged.append((f"{title} ({len(msgs)})", "\n".join(lines)))
+    return merged
+
+
+class NotificationDispatcher:
+    """Shows desktop notifications from a background thread so callers
+    never wait on the notifier process. Bursts are coalesced and rate
+    limited, and anything still queued is shown when the process exits.
+    """
+
+    def __init__(self) -> None:
+        self.queue: queue.Queue[Optional[tuple[str, str]]] = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.closing = False
+        self.notifier_missing = False
+
+    def post(self, title: str, msg: str) -> None:
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="notifications", daemon=True
+                )
+                self.thread.start()
+                atexit.register(self.flush)
+        self.queue.put((title, msg))
+
+    def flush(self) -> None:
+        """Shows everything queued so far without waiting out the rate
+        limit, then stops the dispatcher.
+        """
+        with self.lock:
+            thread = self.thread
+        if thread is None:
+            return
+        self.closing = True
+        self.queue.put(None)
+        thread.join(NOTIF_FLUSH_TIMEOUT)
+
+    def run(self) -> None:
+        last_shown = float("-inf")
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = max(time.monotonic() + NOTIF_COALESCE_WINDOW,
+                           last_shown + NOTIF_MIN_INTERVAL)
+            stopping = False
+            while True:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0 and not self.closing:
+                        item = self.queue.get(timeout=timeout)
+                    else:
+                        item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            for title, msg in coalesce_notifs(batch):
+                self.show(title, msg)
+            last_shown = time.monotonic()
+            if stopping:
+                return
+
+    def show(self, title: str, msg: str) -> None:
+        """Shows a desktop notification where a notifier is available.
+        Every message is already printed by `send_notif`.
+        """
+        command = get_notifier_command(title, msg)
+        if command is None or self.notifier_missing:
+            return
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+        except FileNotFoundError:
+            self.notifier_missing = True
+            print(f"`{command[0]}` not found. "
+                  "See README for installation instructions.",
+                  file=sys.stderr)
+        except subprocess.CalledProcessError as e:
+            print(f"Error running {command[0]}: {e}", file=sys.stderr)
+
+
+_dispatcher = NotificationDispatcher()
+
+
+def reset_dispatcher_after_fork() -> None:
+    """Forked children don't inherit the dispatcher thread."""
+    global _dispatcher
+    _dispatcher = NotificationDispatcher()
+
+
+os.register_at_fork(after_in_child=reset_dispatcher_after_fork)
 
+
+# TODO: add link to file for download complete notification
+def send_notif(title: str, msg: str) -> None:
+    """Queues a desktop notification and returns immediately."""
+    _dispatcher.post(title, msg)
     print(f"{title}: {msg}")
 
 
-def read_metadata(file_path: Path) -> Optional[Metadata]:
+def read_media(
+    file_path: Path,
+) -> tuple[Optional[Metadata], Optional[VideoDetails]]:
+    """Parses a file's URL/title/artist tags and stream details in one
+    MediaInfo pass.
+    """
+    from pymediainfo import MediaInfo
+
     media_info = MediaInfo.parse(file_path)
     if isinstance(media_info, str):
-        return None
+        return None, None
+    metadata = None
+    details = VideoDetails(size=file_path.stat().st_size)
     for track in media_info.tracks:
-        if track.track_type == "General":
-            metadata = Metadata(
-                url=track.url,
-                title=track.title,
-                artist=track.artist,
-            )
-            return metadata
-    return None
-
-
-def get_pid_and_stime() -> tuple[int, float]:
-    pid = os.getpid()
-    stime = psutil.Process(pid).create_time()
-    return pid, stime
-
-
-def process_exists(pid: int, stime: float) -> bool:
-    try:
-        p = psutil.Process(pid)
-    except (psutil.NoSuchProcess, psutil.AccessDenied):
-        return False
-    # exists if create time matches
-    return abs(p.create_time() - stime) <= 1.0
+        match track.track_type:
+            case "General":
+                metadata = Metadata(
+                    url=track.url,
+                    title=track.title,
+                    artist=track.artist,
+                )
+                details.container = track.format
+                if track.duration is not None:
+                    details.duration = float(track.duration) / 1000
+            case "Video" if details.video_codec is None:
+                details.video_codec = track.format
+                details.width = track.width
+                details.height = track.height
+            case "Audio" if details.audio_codec is None:
+                details.audio_codec = track.format
+    return metadata, details
+
+
+def read_metadata(file_path: Path) -> Optional[Metadata]:
+    return read_media(file_path)[0]
+
+
+def get_metadata_args(metadata: Metadata) -> list[str]:
+    """FFmpeg output arguments for the tags `read_metadata` expects."""
+    return [
+        "-metadata", f"URL={metadata.url}",
+        "-metadata", f"title={metadata.title}",
+        "-metadata", f"artist={metadata.artist}",
+    ]
 
 
 def remove_dir_if_empty(dir_path: Path) -> None:
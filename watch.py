@@ -0,0 +1,184 @@
+import re
+import sys
+import time
+from typing import Optional
+
+from config import Config, WatchFeedConfig, load_config
+from constants import CONFIG_PATH, NEWSBOAT_DB_PATH
+from database import (
+    clear_watch_failures,
+    get_downloaded_urls,
+    get_watch_failures,
+    get_watch_position,
+    record_watch_failure,
+    set_watch_position,
+    transaction,
+)
+from download import run_bulk_download
+from models import Metadata
+from newsboat import (
+    fetch_newsboat_feed,
+    get_newsboat_data_version,
+    get_newsboat_max_item_id,
+    iter_newsboat_feed_items,
+)
+from util import send_notif
+
+
+def get_cache_state() -> Optional[tuple[int, Optional[int]]]:
+    """Cheap fingerprint of Newsboat's cache.db that changes whenever
+    Newsboat writes to it.
+    """
+    try:
+        mtime = NEWSBOAT_DB_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return mtime, get_newsboat_data_version()
+
+
+def find_new_items(
+    feed_config: WatchFeedConfig,
+) -> tuple[Optional[str], list[tuple[int, Metadata]], int]:
+    """Returns the feed's rssurl, the items that appeared since the last
+    sync and pass the feed's rules (with their ids), and the highest
+    item id seen.
+    """
+    feed = fetch_newsboat_feed(feed_config.url)
+    if feed is None:
+        print(f"Watched feed not found in Newsboat: {feed_config.url}")
+        return None, [], 0
+
+    last_id = get_watch_position(feed.rssurl)
+    if last_id is None:
+        # Start from the current end of the feed; --feed backfills
+        last_id = get_newsboat_max_item_id(feed)
+        print(f"Watching {feed.title} from item {last_id}")
+        return feed.rssurl, [], last_id
+
+    pattern = None
+    if feed_config.title_pattern is not None:
+        pattern = re.compile(feed_config.title_pattern)
+    items = []
+    records = iter_newsboat_feed_items(
+        feed, ("id", "url", "title", "unread"), after_id=last_id
+    )
+    for item in records:
+        last_id = item.id
+        if not item.unread and not feed_config.include_read:
+            continue
+        if pattern is not None and not pattern.search(item.title):
+            continue
+        items.append((item.id, Metadata(url=item.url, title=item.title,
+                                        artist=feed.title)))
+    return feed.rssurl, items, last_id
+
+
+def is_retry_due(attempts: int, last_attempt: float, config: Config) -> bool:
+    backoff = config.watch.retry_backoff * 2 ** (attempts - 1)
+    return time.time() >= last_attempt + backoff
+
+
+def sync_feeds(config: Config) -> bool:
+    """Enqueues the new items of every watched feed. Returns False if
+    the download batch was canceled.
+
+    A feed's position only advances up to its first item that failed,
+    so failed items are retried by later syncs, waiting longer after
+    each failure. After `max_attempts` failures an item is given up on.
+    """
+    positions = {}
+    items: dict[str, Metadata] = {}
+    # The feeds (and item ids) each URL appeared in
+    item_ids: dict[str, list[tuple[str, int]]] = {}
+    for feed_config in config.watch.feeds:
+        rssurl, feed_items, last_id = find_new_items(feed_config)
+        if rssurl is None:
+            continue
+        positions[rssurl] = last_id
+        for item_id, item in feed_items:
+            items.setdefault(item.url, item)
+            item_ids.setdefault(item.url, []).append((rssurl, item_id))
+
+    def hold_position(url: str) -> None:
+        for rssurl, item_id in item_ids[url]:
+            positions[rssurl] = min(positions[rssurl], item_id - 1)
+
+    downloaded = get_downloaded_urls(items)
+    failures = get_watch_failures(
+        url for url in items if url not in downloaded
+    )
+    new_items = []
+    for url, item in items.items():
+        if url in downloaded:
+            continue
+        attempts, last_attempt = failures.get(url, (0, 0.0))
+        if attempts >= config.watch.max_attempts:
+            continue
+        if attempts and not is_retry_due(attempts, last_attempt, config):
+            hold_position(url)
+            continue
+        new_items.append(item)
+    if new_items:
+        send_notif("Starting Bulk Download", f"{len(new_items)} new videos")
+        summary = run_bulk_download(
+            [(item.url, item.title) for item in new_items],
+            config,
+            {item.url: item for item in new_items},
+        )
+        if summary.canceled:
+            return False
+        send_notif("Finished Bulk Download", summary.describe())
+        failed = set(summary.failed_urls)
+        for url in failed:
+            if record_watch_failure(url) < config.watch.max_attempts:
+                hold_position(url)
+            else:
+                send_notif("Giving Up", f"{items[url].title} failed "
+                           f"{config.watch.max_attempts} times: {url}")
+        clear_watch_failures(
+            item.url for item in new_items if item.url not in failed
+        )
+
+    with transaction():
+        for rssurl, last_id in positions.items():
+            set_watch_position(rssurl, last_id)
+    return True
+
+
+def watch(config: Config, once: bool) -> None:
+    """Syncs the watched feeds whenever Newsboat's cache changes,
+    checking every `poll_interval` seconds.
+    """
+    last_state = None
+    while True:
+        state = get_cache_state()
+        if state is not None and state != last_state:
+            if not sync_feeds(config):
+                sys.exit(1)
+            last_state = state
+        if once:
+            return
+        time.sleep(config.watch.poll_interval)
+
+
+def main() -> None:
+    config = load_config(CONFIG_PATH)
+    if config is None:
+        sys.exit(1)
+
+    args = sys.argv[1:]
+    if args not in ([], ["--once"]):
+        send_notif("Error", f"Invalid Arguments: {args}")
+        sys.exit(1)
+    if not config.watch.feeds:
+        send_notif("Error", "No feeds configured under [[watch.feeds]]")
+        sys.exit(1)
+
+    try:
+        watch(config, once=args == ["--once"])
+    except KeyboardInterrupt:
+        print("Stopped watching")
+
+
+if __name__ == "__main__":
+    main()